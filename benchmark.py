@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for State of the Field.
+
+Times the listing and abstract parsers, deduplication, the search index and
+ranking by My Library over synthetic corpora, My Library at growing sizes and,
+when there is a display (e.g. under xvfb-run), drawing and scrolling the paper
+list. Each result is written as one JSON line, so runs can be kept and compared
+over time:
+
+    python benchmark.py --output bench.jsonl
+    xvfb-run python benchmark.py --only render
+
+The listing and article pages are generated to match each site's markup. To
+time real ones instead, save them into a directory as prb.html, nat.html,
+arx.html, prb_abstract.html, nat_abstract.html and arx_abstract.html and pass
+it with --fixtures.
+
+
+@author: jgwillingham
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import journals
+from journals import Paper, Deduplicator, sources
+
+
+corpus_sizes = [1000, 10000, 100000]
+library_sizes = [100, 1000, 10000]
+rank_library_size = 3000 # saved papers the corpus is ranked against
+crawl_depth = 10 # listing pages of each journal parsed in the deep crawl cases
+default_repeat = 5 # timed runs per case; the best and the median are reported
+queries = ['spin', 'topo', 'spin liquid', '"quantum spin liquid"', 'author:smith', 'kagome OR pyrochlore', 'abstract:phonon title:hall']
+
+vocabulary = ('quantum spin liquid hall topological insulator superconductivity superconductor graphene twisted bilayer '
+              'moire magnon phonon kagome pyrochlore lattice frustration dirac weyl semimetal fermi surface edge state '
+              'electron correlation thermal transport anomalous nematic charge density wave pairing symmetry ferromagnet '
+              'antiferromagnet skyrmion exciton polariton flat band heavy fermion kondo mott transition strain pressure '
+              'thin film heterostructure interface spectroscopy photoemission neutron scattering muon resonance optical '
+              'conductivity magnetoresistance entanglement disorder localization criticality phase diagram ground').split()
+function_words = 'the of and in a to we is that for with by on this are as which be at from an its these show'.split() # most of any abstract
+syllables = 'ba co de fi gu ha ji ko lu ma ne no pi qu ra se ti vo xa ze ium ene ide ate ite ox ph th'.split()
+rare_words = sorted({''.join(random.Random(i).choices(syllables, k=3)) for i in range(3000)}) # the long tail of materials and methods
+surnames = ('Smith Wang Li Zhang Chen Liu Kim Park Nguyen Müller Schmidt Rossi García Martin Ivanov Sato Suzuki Tanaka '
+            'Kumar Singh Cohen Levi Brown Jones Miller Davis Wilson Taylor Anderson Thomas Moore Jackson White Harris').split()
+
+
+def _title(rng):
+    words = [rng.choice(vocabulary) if rng.random() < 0.7 else rng.choice(rare_words) for i in range(rng.randint(5, 12))]
+    return ' '.join(words).capitalize()
+
+
+def _authors(rng):
+    names = [f'{rng.choice("ABCDEFGHJKLMNPRSTW")}. {rng.choice(surnames)}' for i in range(rng.randint(1, 8))]
+    if len(names) == 1:
+        return names[0]
+    return ', '.join(names[:-1]) + ', and ' + names[-1]
+
+
+def corpus(size, seed=0):
+    # synthetic papers spread over the journals, with titles, authors and abstracts drawn from the vocabulary
+    rng = random.Random(seed)
+    papers = []
+    for i in range(size):
+        source = rng.choice(list(journals.journal_names))
+        abstract = ' '.join(rng.choice(function_words) if rng.random() < 0.75 else rng.choice(vocabulary) for i in range(rng.randint(60, 150)))
+        papers.append(Paper(source, f'{source}:{i}', _title(rng), _authors(rng), f'https://example.org/{source}/{i}', f'Synthetic {i}', abstract))
+    return papers
+
+
+def listing_pages(seed=0):
+    # pages shaped like each site's listing and article markup, as the parsers expect it
+    rng = random.Random(seed)
+    filler = '<p>' + ' '.join(rng.choices(vocabulary, k=40)) + '</p>'
+    parts = ['<html><head><meta charset="utf-8"><title>PRB</title></head><body><div class="nav"><h5 class="title hidden">nav</h5></div>']
+    for i in range(25):
+        parts.append(f'<div class="article panel"><div class="row"><h5 class="title"><a href="/prb/abstract/10.1103/PhysRevB.97.{100000+i}">{_title(rng)}</a></h5>'
+                     f'<h6 class="authors">{_authors(rng)}</h6><h6 class="pub-info">Phys. Rev. B 97, {100000+i} – Published 28 March 2018</h6>'
+                     + filler*8 + '</div></div>')
+    parts.append('</body></html>')
+    pages = {'prb':''.join(parts)}
+
+    parts = ['<html><head><meta charset="utf-8"></head><body><dl>']
+    for i in range(200):
+        arxiv_id = f'1803.{10000+i}'
+        authors = _authors(rng).replace(', and ', ', ').split(', ')
+        parts.append(f'<dt><span class="list-identifier"><a href="/abs/{arxiv_id}" title="Abstract">arXiv:{arxiv_id}</a> [<a href="/pdf/{arxiv_id}" title="Download PDF">pdf</a>]</span></dt>'
+                     f'<dd><div class="meta"><div class="list-title mathjax">\n<span class="descriptor">Title:</span> {_title(rng)}\n</div>\n'
+                     '<div class="list-authors">\n<span class="descriptor">Authors:</span>\n'
+                     + ', \n'.join(f'<a href="/find/cond-mat/1/au:+x/0/1/0/all/0/1">{name}</a>' for name in authors) + '\n</div>\n'
+                     f'<div class="list-comments mathjax">Comments: 5 pages</div>{filler}</div></dd>')
+    parts.append('</dl></body></html>')
+    pages['arx'] = ''.join(parts)
+
+    parts = ['<html><head><meta charset="utf-8"></head><body><ol>']
+    for i in range(50):
+        authors = _authors(rng).replace(', and ', ', ').split(', ')
+        parts.append(f'<li class="mb20 pb20 cleared" data-x="author-list"><p>Article | {1+i%28} March 2018</p>'
+                     f'<h2><a href="https://www.nature.com/articles/s41567-018-{i:04d}-x">{_title(rng)}</a></h2><ul class="js-list-authors">' + ''.join(f'<li itemprop="author">{name}</li>' for name in authors) + '</ul>'
+                     '<p>Nature Physics</p><p>Rights\xa0&amp; permissions</p></li><li class="x" data-x="author-link">Opens in a new window</li>')
+    parts.append('</ol>' + '<li class="foot" data-y="author">footer</li>'*8 + '</body></html>')
+    pages['nat'] = ''.join(parts)
+
+    abstract = ' '.join(rng.choices(vocabulary, k=150))
+    pages['prb_abstract'] = f'<html><body><p>{abstract}</p>{filler*30}</body></html>'
+    pages['nat_abstract'] = f'<html><body><p>Nature</p><p>Article</p><p>Open access</p><p>Published</p><p>{abstract}</p>{filler*30}</body></html>'
+    pages['arx_abstract'] = f'<html><body>{filler*10}<blockquote class="abstract mathjax"><span class="descriptor">Abstract:</span> {abstract}</blockquote>{filler*10}</body></html>'
+    return {name:page.encode('utf-8') for name, page in pages.items()}
+
+
+def saved_pages(directory):
+    pages = {}
+    for name in ('prb', 'nat', 'arx', 'prb_abstract', 'nat_abstract', 'arx_abstract'):
+        with open(os.path.join(directory, name + '.html'), 'rb') as page:
+            pages[name] = page.read()
+    return pages
+
+
+def timed(function, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+class Recorder:
+    # writes one JSON line per result
+    def __init__(self, out, repeat):
+        self.out = out
+        self.repeat = repeat
+
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + '\n')
+        self.out.flush()
+
+
+    def time(self, benchmark, case, function, size=None, repeat=None):
+        repeat = repeat or self.repeat
+        best, median = timed(function, repeat)
+        self.write({'benchmark':benchmark, 'case':case, 'size':size, 'runs':repeat, 'best':best, 'median':median})
+
+
+
+def bench_parse(record, pages):
+    for source in ('prb', 'nat', 'arx'):
+        listing = pages[source]
+        count = len(sources[source].parse_listing(listing))
+        record.time('parse', f'{source} listing ({count} papers)', lambda: sources[source].parse_listing(listing), size=len(listing))
+        abstract = pages[source + '_abstract']
+        record.time('parse', f'{source} abstract', lambda: sources[source].parse_abstract(abstract), size=len(abstract))
+    # a deep crawl's listings, parsed on the fetch threads and then in the parse processes
+    jobs = [source for source in ('prb', 'nat', 'arx') for page in range(crawl_depth)]
+    def parse_crawl(parser):
+        with ThreadPoolExecutor(max_workers=journals.fetch_workers) as threads:
+            list(threads.map(lambda source: journals._parse_listing(sources[source], pages[source], parser), jobs))
+    record.time('parse', f'{len(jobs)} listings on {journals.fetch_workers} threads', lambda: parse_crawl(None))
+    parser = journals.parse_pool()
+    if parser is None:
+        record.write({'benchmark':'parse', 'case':f'{len(jobs)} listings in processes', 'skipped':f'{os.cpu_count()} core(s); set parse_workers to try it anyway'})
+        return
+    parse_crawl(parser) # starts the processes
+    record.time('parse', f'{len(jobs)} listings in {journals.parse_workers} processes', lambda: parse_crawl(parser))
+
+
+def bench_dedup(record, sizes):
+    for size in sizes:
+        papers = corpus(size)
+        def run():
+            dedup = Deduplicator()
+            for paper in papers:
+                paper.versions.clear()
+                dedup.add(paper)
+        record.time('dedup', 'add all', run, size=size, repeat=1)
+
+
+def bench_search(record, sizes):
+    from search import SearchIndex, AuthorIndex, AbstractStore
+    for size in sizes:
+        papers = corpus(size)
+        index = SearchIndex()
+        def build():
+            index.__init__()
+            for paper in papers:
+                index.add(paper)
+        record.time('search', 'build index', build, size=size, repeat=1)
+        authors = AuthorIndex()
+        def build_authors():
+            authors.__init__()
+            for paper in papers:
+                authors.add(paper)
+        record.time('search', 'build author index', build_authors, size=size, repeat=1)
+        record.time('search', 'complete author s', lambda: authors.complete('s'), size=size)
+        record.time('search', 'papers by smith', lambda: authors.papers_by('smith'), size=size)
+        for query in queries:
+            record.time('search', f'query {query}', lambda: index.search(query), size=size)
+        ids = {paper.id for paper in papers[-len(papers)//10:]}
+        record.time('search', 'query spin liquid within the newest tenth', lambda: index.search('spin liquid', within=ids), size=size)
+        typed = 'kagome spin liquid'
+        record.time('search', f'type {typed} from scratch', lambda: [index.search(typed[:n]) for n in range(2, len(typed)+1)], size=size)
+        record.time('search', f'type {typed} narrowing', lambda: type_narrowing(index, typed), size=size)
+        # late in a long session most abstracts are only in the archive, and a phrase reads them back
+        with tempfile.TemporaryDirectory() as directory:
+            archive = journals.PaperArchive(os.path.join(directory, 'archive.sqlite'), journals.archive_age)
+            archive.add(1, {paper.id:paper for paper in papers})
+            store = AbstractStore(archive, sum(len(paper.abstract) for paper in papers)//10)
+            for paper in papers:
+                store.add(paper)
+            index.texts = lambda papers, field: store.texts(papers) if field == 'abstract' else SearchIndex._texts(papers, field)
+            phrase = '"quantum spin liquid"'
+            record.time('search', f'query {phrase} with 90% of abstracts evicted', lambda: index.search(phrase), size=size)
+            archive.db.close()
+
+
+def type_narrowing(index, typed):
+    # one search per keystroke, each within the hits of the last, as the search box does
+    hits = None
+    for n in range(2, len(typed)+1):
+        hits = set(index.search(typed[:n], within=hits))
+
+
+def bench_rank(record, sizes):
+    # sorting by My Library: fitting the ranker to a library, then scoring a corpus against it
+    from search import SearchIndex, LibraryRanker
+    saved = corpus(rank_library_size, seed=1)
+    record.time('rank', 'fit library', lambda: LibraryRanker(saved), size=rank_library_size)
+    ranker = LibraryRanker(saved)
+    for size in sizes:
+        papers = corpus(size)
+        index = SearchIndex()
+        for paper in papers:
+            index.add(paper)
+        record.time('rank', f'score against {rank_library_size} saved', lambda: ranker.scores(papers, index), size=size)
+
+
+def bench_library(record, sizes):
+    from library import Library
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            library = Library(os.path.join(directory, 'library.sqlite'))
+            papers = corpus(size + default_repeat*10, seed=1)
+            for paper in papers[:size]:
+                library.save(paper)
+            spare = iter(papers[size:])
+            saved = iter(papers[:size])
+            imports = itertools.count()
+            record.time('library', 'load', library.papers, size=size)
+            record.time('library', 'save', lambda: library.save(next(spare)), size=size)
+            record.time('library', 'remove', lambda: library.remove(next(saved)), size=size)
+            record.time('library', 'search spin liquid', lambda: library.search('spin liquid'), size=size)
+            for extension in ('.bib', '.jsonl', '.csv'):
+                path = os.path.join(directory, 'library' + extension)
+                record.time('library', f'export {extension}', lambda: library.export_file(path), size=size, repeat=1)
+                def import_file():
+                    # into an empty library each time, so that every paper is written
+                    other = Library(os.path.join(directory, f'import{next(imports)}.sqlite'))
+                    other.import_file(path)
+                    other.db.close()
+                record.time('library', f'import {extension}', import_file, size=size, repeat=1)
+            library.db.close()
+
+
+def bench_render(record, sizes):
+    # draws and scrolls the real window, with the network and the on-disk files swapped for synthetic ones
+    import tkinter as tk
+    import stateofthefield
+    try:
+        tk.Tk().destroy()
+    except tk.TclError as error:
+        record.write({'benchmark':'render', 'skipped':f'no display ({error}); run under xvfb-run'})
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        stateofthefield.database_path = os.path.join(directory, 'library.sqlite')
+        stateofthefield.csv_database_path = os.path.join(directory, 'library.csv')
+        stateofthefield.archive_path = os.path.join(directory, 'archive.sqlite')
+        stateofthefield.cache_path = os.path.join(directory, 'cache.sqlite')
+        stateofthefield.get_papers = lambda source, page, cache, deadline=None, parser=None, limiter=None: {}
+        stateofthefield.get_abstract = lambda paper, cache, limiter: paper.abstract
+        for size in sizes:
+            app = stateofthefield.Main()
+            app.update()
+            filters = app.elements[stateofthefield.Filters]
+            canvas = app.elements[stateofthefield.Papers]
+            loaded = {}
+            for paper in corpus(size):
+                loaded.setdefault((paper.source, 1), {})[paper.id] = paper
+            canvas._merge_pages(loaded)
+            def draw():
+                filters.refresh()
+                app.update()
+            record.time('render', 'show all papers', draw, size=size)
+            positions = [i/50 for i in range(50)]
+            def scroll():
+                for position in positions:
+                    canvas.yview_moveto(position)
+                    canvas._render_rows()
+                    app.update_idletasks()
+            record.time('render', 'scroll through 50 positions', scroll, size=size)
+            filters.search_str.set('spin liquid')
+            record.time('render', 'search spin liquid and redraw', draw, size=size)
+            app.destroy()
+
+
+benchmarks = {'parse':bench_parse, 'dedup':bench_dedup, 'search':bench_search, 'rank':bench_rank, 'library':bench_library, 'render':bench_render}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the parsers, search, library and list rendering offline, as JSON Lines.')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), default=list(benchmarks), help='which benchmarks to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, help='corpus sizes for dedup, search, rank and render (default: 1000 10000 100000)')
+    parser.add_argument('--library-sizes', nargs='+', type=int, default=library_sizes, help='My Library sizes (default: 100 1000 10000)')
+    parser.add_argument('--repeat', type=int, default=default_repeat, help='timed runs per case')
+    parser.add_argument('--fixtures', help='directory of saved listing and article pages to parse instead of generated ones')
+    parser.add_argument('--output', default='-', help='file to append to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    record = Recorder(out, args.repeat)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    record.write({'benchmark':'run', 'started':time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit':commit, 'python':sys.version.split()[0]})
+    try:
+        for name in args.only:
+            if name == 'parse':
+                bench_parse(record, saved_pages(args.fixtures) if args.fixtures else listing_pages())
+            elif name == 'library':
+                bench_library(record, args.library_sizes)
+            else:
+                benchmarks[name](record, args.sizes or corpus_sizes)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+
+if __name__ == '__main__':
+    main()
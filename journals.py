@@ -0,0 +1,889 @@
+# -*- coding: utf-8 -*-
+"""
+The fetching and parsing half of State of the Field, with no GUI attached.
+
+Everything here can be imported without tkinter or a display, so the journals
+can be scraped from a cron job or a server. Run as a script to stream the
+newest papers as JSON Lines:
+
+    python journals.py --journals prb arx --pages 2 --output papers.jsonl
+
+
+@author: jgwillingham
+"""
+
+import http.client
+import urllib.error
+import urllib.parse
+import lxml.html
+import sqlite3
+import threading
+import time
+import os
+import sys
+import json
+import re
+import hashlib
+import random
+import unicodedata
+import argparse
+import dataclasses
+import multiprocessing
+from dataclasses import dataclass
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import tracing
+from tracing import span, traced
+
+
+fetch_workers = 8 # how many pages may be downloaded at the same time
+parse_workers = min(8, (os.cpu_count() or 1) - 1) # processes parsing listing pages; below 2, pages are parsed on the fetch threads
+parse_in_process_pages = 4 # crawls of no more pages than this parse on the fetch threads, as starting processes would cost more
+host_interval = 1.0 # seconds between requests to the same host, listings and abstracts alike, unless its source says otherwise
+connections_per_host = 4 # connections kept open to each host, unless its source says otherwise
+fetch_timeout = 15 # seconds to wait on a silent server before giving up on a try
+fetch_retries = 2 # further tries after a timeout, a dropped connection or a 429/5xx status
+retry_delay = 1.0 # seconds before the first retry, doubled for each one after; the actual wait is a random fraction of it
+retry_statuses = {429, 500, 502, 503, 504}
+breaker_failures = 3 # fetches in a row that may fail for a journal before it is left alone for a while
+breaker_cooldown = 5*60 # seconds a failing journal is left alone before one fetch is let through to test it
+max_redirects = 5
+user_agent = f'Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}'
+
+cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_cache.sqlite')
+cache_size = 200*1024*1024 # bytes of downloaded pages kept on disk; the least recently used are dropped first
+cache_ttls = { # seconds a cached page is used before checking with the server again, by url prefix
+        'https://arxiv.org/list/':60*60,
+        'https://journals.aps.org/prb/recent':60*60,
+        'https://www.nature.com/search':60*60,
+        }
+default_cache_ttl = 30*24*60*60 # article pages almost never change
+archive_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'paper_archive.sqlite')
+archive_age = 90*24*60*60 # seconds a paper stays in the archive after it was last listed
+listing_ttl = 60*60 # cache ttl given to the listing pages of newly registered sources
+
+journal_names = {} # filled in by register_source, in the order the journals are listed
+host_intervals = {}
+arxiv_history_url = 'https://arxiv.org/list/cond-mat/pastweek?skip={skip}&show={show}'
+arxiv_page_size = 100 # papers on each page of arXiv history after the /new listing
+
+dedup_threshold = 0.8 # title overlap above which papers from two journals are taken to be the same work
+minhash_bands = 12 # LSH bands; bands*rows hashes go into each title's signature
+minhash_rows = 6 # hashes per band; more rows means fewer, closer candidates to check
+
+
+
+@dataclass(slots=True, eq=False)
+class Paper:
+    # one listed paper; id is the DOI (or arXiv id), and papers compare by identity
+    source: str
+    id: str
+    title: str
+    authors: str
+    link: str
+    pubinfo: str
+    abstract: str = ''
+    versions: list = dataclasses.field(default_factory=list) # the same work as listed by other journals
+
+
+
+class ResponseCache:
+    """
+    Keeps downloaded pages on disk between runs, keyed by url.
+    
+    A page younger than its ttl is served straight from disk. An older one is
+    revalidated with If-None-Match/If-Modified-Since, so the body is only
+    downloaded again if it has changed. Safe to use from the fetch threads.
+    """
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # several batch runs may share one cache file, so wait on each other's writes
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, fetched REAL, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses').fetchone()[0]
+    
+    
+    def ttl(self, link):
+        prefixes = [prefix for prefix in cache_ttls if link.startswith(prefix)]
+        if len(prefixes) == 0:
+            return default_cache_ttl
+        return cache_ttls[max(prefixes, key=len)]
+    
+    
+    def fetch(self, link, limiter=None, deadline=None):
+        with span('cached fetch', url=link) as fetch_span:
+            now = time.time()
+            with self.lock:
+                cached = self.db.execute('SELECT body, etag, last_modified, fetched FROM responses WHERE url=?', (link,)).fetchone()
+            if cached is not None and now - cached[3] < self.ttl(link):
+                fetch_span.set(cache='fresh')
+                self._touch(link, now, refreshed=False)
+                return cached[0]
+            
+            headers = {}
+            if cached is not None and cached[1]:
+                headers['If-None-Match'] = cached[1]
+            if cached is not None and cached[2]:
+                headers['If-Modified-Since'] = cached[2]
+            if limiter is not None:
+                limiter.wait(link)
+            status, response_headers, body = download(link, headers, deadline)
+            if status == 304 and cached is not None:
+                fetch_span.set(cache='revalidated')
+                self._touch(link, now, refreshed=True)
+                return cached[0]
+            fetch_span.set(cache='miss' if cached is None else 'changed')
+            self._store(link, body, response_headers.get('ETag'), response_headers.get('Last-Modified'), now)
+            return body
+    
+    
+    def stale(self, link):
+        # the cached page however old it is, for when the site cannot be reached
+        with self.lock:
+            cached = self.db.execute('SELECT body FROM responses WHERE url=?', (link,)).fetchone()
+        return None if cached is None else cached[0]
+    
+    
+    def _touch(self, link, now, refreshed):
+        with self.lock, self.db:
+            if refreshed:
+                self.db.execute('UPDATE responses SET fetched=?, used=? WHERE url=?', (now, now, link))
+            else:
+                self.db.execute('UPDATE responses SET used=? WHERE url=?', (now, link))
+    
+    
+    @traced('cache store')
+    def _store(self, link, body, etag, last_modified, now):
+        with self.lock, self.db:
+            old = self.db.execute('SELECT LENGTH(body) FROM responses WHERE url=?', (link,)).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', (link, body, etag, last_modified, now, now))
+            self.size += len(body)
+            while self.size > self.max_size:
+                oldest = self.db.execute('SELECT url, LENGTH(body) FROM responses ORDER BY used LIMIT 1').fetchone()
+                self.db.execute('DELETE FROM responses WHERE url=?', (oldest[0],))
+                self.size -= oldest[1]
+    
+
+class ConnectionPool:
+    """
+    Keeps HTTP/1.1 connections to each host open between requests and shares
+    them between the fetch threads, so reading many pages of a journal costs a
+    TCP and TLS handshake per connection rather than per page. At most `limit`
+    requests are open to one host at a time; the others wait for a free slot.
+    """
+    stale_errors = (http.client.RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+    
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.hosts = {}
+    
+    
+    def set_limit(self, host, limit):
+        self.limits[host] = limit
+    
+    
+    def _host(self, scheme, host):
+        with self.lock:
+            if (scheme, host) not in self.hosts:
+                self.hosts[(scheme, host)] = (threading.BoundedSemaphore(self.limits.get(host, self.limit)), [])
+            return self.hosts[(scheme, host)]
+    
+    
+    def request(self, link, headers=None, timeout=None):
+        # returns (status, headers, body), following redirects; timeout overrides the pool's for this request
+        for i in range(max_redirects+1):
+            parts = urllib.parse.urlsplit(link)
+            target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            slots, idle = self._host(parts.scheme, parts.netloc)
+            with slots:
+                status, response_headers, body = self._send(parts.scheme, parts.netloc, idle, target, headers, timeout or self.timeout)
+            if status not in (301, 302, 303, 307, 308) or 'Location' not in response_headers:
+                return status, response_headers, body
+            link = urllib.parse.urljoin(link, response_headers['Location'])
+        raise urllib.error.HTTPError(link, status, 'Too many redirects', response_headers, None)
+    
+    
+    def _send(self, scheme, host, idle, target, headers, timeout):
+        request_headers = {'User-Agent':user_agent}
+        request_headers.update(headers or {})
+        give_up = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                connection = idle.pop() if len(idle) > 0 else None
+            reused = connection is not None
+            if not reused:
+                connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+                connection = connection_class(host, timeout=timeout)
+            else:
+                connection.sock.settimeout(timeout)
+            try:
+                if not reused:
+                    # DNS, TCP and TLS, timed apart from the request itself
+                    with span('connect', host=host):
+                        connection.connect()
+                with span('download', host=host, path=target, reused=reused) as download_span:
+                    connection.request('GET', target, headers=request_headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                    download_span.set(status=response.status, bytes=len(body))
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                # the server may have dropped a connection that sat idle, which it says at once; that is
+                # worth another go on another connection, within the same timeout, but a hung server is not
+                if reused and isinstance(error, self.stale_errors) and time.monotonic() < give_up:
+                    timeout = give_up - time.monotonic()
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                with self.lock:
+                    idle.append(connection)
+            return response.status, response.headers, body
+    
+
+connections = ConnectionPool(connections_per_host, fetch_timeout)
+
+
+class OutOfTime(TimeoutError):
+    # the caller's deadline passed, which says nothing about the site itself
+    pass
+
+
+def download(link, headers=None, deadline=None):
+    # one GET through the shared connection pool; error statuses raise HTTPError like urlopen did.
+    # Failures that may pass are tried again after a jittered, growing delay, all within the
+    # deadline (a time.monotonic() time), which also cuts short the timeout of the last try
+    for attempt in range(fetch_retries+1):
+        timeout = fetch_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise OutOfTime(f'gave up on {link}: out of time')
+        try:
+            status, response_headers, body = connections.request(link, headers, timeout)
+            if status >= 400:
+                raise urllib.error.HTTPError(link, status, http.client.responses.get(status, ''), response_headers, None)
+            return status, response_headers, body
+        except urllib.error.HTTPError as error:
+            if error.code not in retry_statuses or attempt == fetch_retries:
+                raise
+        except (OSError, http.client.HTTPException):
+            if attempt == fetch_retries:
+                raise
+        delay = random.uniform(0, retry_delay*2**attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise OutOfTime(f'gave up on {link}: out of time')
+        with span('retry', url=link, attempt=attempt+1):
+            time.sleep(delay)
+
+
+
+class SourceUnavailable(OSError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Leaves alone a journal whose fetches keep failing, so that a site which is
+    down costs one quick error rather than a timeout per page. After `failures`
+    failures in a row the journal's fetches raise SourceUnavailable for
+    `cooldown` seconds; then one is let through, and its outcome either clears
+    the journal or starts another cooldown. Safe to use from the fetch threads.
+    """
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failed = {}
+        self.closed_until = {}
+        self.testing = set()
+    
+    
+    def check(self, key):
+        with self.lock:
+            until = self.closed_until.get(key)
+            if until is None:
+                return
+            wait = until - time.monotonic()
+            if wait > 0 or key in self.testing:
+                raise SourceUnavailable(f'{journal_names.get(key, key)} keeps failing; trying again in {max(wait, 0):.0f}s')
+            self.testing.add(key)
+    
+    
+    def succeeded(self, key):
+        with self.lock:
+            self.failed.pop(key, None)
+            self.closed_until.pop(key, None)
+            self.testing.discard(key)
+    
+    
+    def failed_once(self, key):
+        with self.lock:
+            self.failed[key] = self.failed.get(key, 0) + 1
+            self.testing.discard(key)
+            if self.failed[key] >= self.failures:
+                self.closed_until[key] = time.monotonic() + self.cooldown
+    
+    
+    def reset(self, key):
+        # e.g. when asked to retry by hand
+        self.succeeded(key)
+    
+    
+    def finished(self, key):
+        # the test fetch ended without saying whether the site is well, e.g. on a 404; the next one tests it again
+        with self.lock:
+            self.testing.discard(key)
+
+
+breakers = CircuitBreaker(breaker_failures, breaker_cooldown)
+
+
+def _guarded(source, fetch):
+    # runs fetch() through the journal's circuit breaker; only failures that say the site
+    # is unwell count against it, not e.g. a missing article
+    breakers.check(source)
+    try:
+        result = fetch()
+    except urllib.error.HTTPError as error:
+        if error.code in retry_statuses:
+            breakers.failed_once(source)
+        raise
+    except OutOfTime:
+        raise
+    except (OSError, http.client.HTTPException):
+        breakers.failed_once(source)
+        raise
+    finally:
+        breakers.finished(source)
+    breakers.succeeded(source)
+    return result
+
+
+
+class PaperArchive:
+    """
+    Every paper that has been listed, kept on disk so the app can start from it,
+    and work offline, before anything is downloaded.
+    
+    Papers come back in the order they were listed, newest session first, with
+    any abstract fetched since. A paper not listed again for max_age seconds is
+    dropped. Safe to use from the fetch threads.
+    """
+    def __init__(self, path, max_age):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS papers (id TEXT PRIMARY KEY, source TEXT, title TEXT, authors TEXT, link TEXT, pubinfo TEXT, abstract TEXT, session INTEGER, page INTEGER, position INTEGER, seen REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS papers_order ON papers (session, page, position)')
+            self.db.execute('DELETE FROM papers WHERE seen < ?', (time.time() - max_age,))
+        self.session = self.db.execute('SELECT COALESCE(MAX(session), 0) + 1 FROM papers').fetchone()[0]
+    
+    
+    @traced('archive load')
+    def papers(self):
+        # returns {source: {id: Paper}}
+        with self.lock:
+            rows = self.db.execute('SELECT source, id, title, authors, link, pubinfo, abstract FROM papers ORDER BY session DESC, page, position').fetchall()
+        archived = {}
+        for row in rows:
+            archived.setdefault(row[0], {})[row[1]] = Paper(*row)
+        return archived
+    
+    
+    @traced('archive add')
+    def add(self, page, papers):
+        # papers that are already archived keep their place and abstract
+        now = time.time()
+        rows = [(paper.source, paper.id, paper.title, paper.authors, paper.link, paper.pubinfo, paper.abstract, self.session, page, position, now)
+                for position, paper in enumerate(papers.values())]
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO papers (source, id, title, authors, link, pubinfo, abstract, session, page, position, seen) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET seen=excluded.seen', rows)
+    
+    
+    @traced('archive abstract')
+    def set_abstract(self, paper_id, abstract):
+        with self.lock, self.db:
+            self.db.execute('UPDATE papers SET abstract=? WHERE id=?', (abstract, paper_id))
+    
+    
+    @traced('archive abstracts')
+    def abstracts(self, paper_ids):
+        # {id: abstract} for those of the papers that are archived, read a few hundred per query
+        found = {}
+        with self.lock:
+            for start in range(0, len(paper_ids), 500):
+                chunk = paper_ids[start:start+500]
+                found.update(self.db.execute(f'SELECT id, abstract FROM papers WHERE id IN ({",".join("?"*len(chunk))})', chunk))
+        return found
+    
+
+class HostLimiter:
+    # spaces out requests to each host so the background fetches stay polite
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_request = {}
+    
+    
+    def wait(self, link):
+        host = urllib.parse.urlsplit(link).netloc
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request.get(host, now))
+            self.next_request[host] = start + host_intervals.get(host, self.interval)
+        if start > now:
+            with span('rate limit', host=host):
+                time.sleep(start - now)
+    
+
+
+# The listing parsers below pull just the nodes they need out of the page with
+# XPath in a single lxml pass, rather than building and walking a full soup.
+
+def _html_tree(html):
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', 'replace')
+    return lxml.html.document_fromstring(html)
+
+
+def _has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def parse_PhysRevB_listing(html):
+    page = _html_tree(html)
+    prb_titles = page.xpath('//h5[@class="title"]')
+    prb_authors = page.xpath(f'//h6[{_has_class("authors")}]')
+    prb_pubinfo = page.xpath(f'//h6[{_has_class("pub-info")}]')
+    prb_papers = {}
+    for inx, item in enumerate(prb_titles):
+        title = item.text_content()
+        authors = prb_authors[inx].text_content()
+        href = item.xpath('.//a/@href')[0]
+        link = 'https://journals.aps.org' + href
+        pubinfo = prb_pubinfo[inx].text_content()
+        doi = href.split('/abstract/')[-1]
+        prb_papers[doi] = Paper('prb', doi, title, authors, link, pubinfo)
+    return prb_papers
+
+
+def parse_arXiv_listing(html):
+    page = _html_tree(html)
+    arx_titles = page.xpath(f'//div[{_has_class("list-title")}]')
+    arx_authors = page.xpath(f'//div[{_has_class("list-authors")}]')
+    arx_pubinfo = page.xpath('//a[starts-with(@href, "/abs") and contains(@title, "Abstract")]/text()')
+    
+    arx_papers = {}
+    for inx in range(len(arx_titles)):
+        title = arx_titles[inx].text_content().split(' ', 1)[1].split('\n')[0]
+        authors_list = arx_authors[inx].text_content().split('\nAuthors:\n', 1)[1].split(', \n')
+        authors_list[-1] = authors_list[-1].split('\n')[0]
+        authors = ''
+        for i in range(len(authors_list)):
+            if i == 0:
+                authors += authors_list[i]
+            elif i == len(authors_list)-1 and i != 0:
+                authors += ', and ' +authors_list[i]
+            else:
+                authors += ', ' + authors_list[i]
+        pubinfo = str(arx_pubinfo[inx])
+        arxiv_id = pubinfo.split(':')[1]
+        link = 'https://arxiv.org/abs/' + arxiv_id
+        arx_papers['arXiv:'+arxiv_id] = Paper('arx', 'arXiv:'+arxiv_id, title, authors, link, pubinfo+' \u2013 Recent')
+    return arx_papers
+
+
+def parse_Nature_listing(html):
+    page = _html_tree(html)
+    page_articles = page.xpath('//a[contains(@href, "nature.com/articles")]')
+    nat_titles = [item.text_content() for item in page_articles]
+    nat_links = [item.get('href') for item in page_articles]
+    page_papers_info = [item.text_content() for item in page.xpath('//li[descendant-or-self::*/@*[contains(., "author")] or contains(., "author")]')]
+    nat_authors = []
+    nat_pubinfo = []
+    j = 0
+    for i in range(len(page_papers_info)):
+        if j == len(nat_titles):
+            break
+        if nat_titles[j] in page_papers_info[i]:
+            k = i + 1
+            names = []
+            while 'Opens in a new window' not in page_papers_info[k]:
+                names.append(page_papers_info[k])
+                k += 1
+                if k == len(page_papers_info)-6:
+                    break
+            # the names run together in the page text, which the pubinfo is split on
+            authors = ''.join(names)
+            nat_authors.append(', '.join(name.strip() for name in names))
+            date = page_papers_info[i].split(' | ')[1].split(nat_titles[j])[0]
+            branch = page_papers_info[i].split(authors)[1].split('Rights\xa0')[0]
+            nat_pubinfo.append(branch + ' \u2013 Published '+ date)
+            j += 1
+
+    nat_papers = {}
+    for i in range(len(nat_titles)):
+        link = nat_links[i]
+        doi = '10.1038/' + link.rstrip('/').rsplit('/', 1)[-1]
+        nat_papers[doi] = Paper('nat', doi, nat_titles[i], nat_authors[i], link, nat_pubinfo[i])
+    return nat_papers
+
+
+@dataclass
+class Source:
+    """
+    A journal that can be read. Its listing pages are listing_url formatted with
+    the page number, and parse_listing turns one into {id: Paper}. The abstract
+    is the text of the first node matching abstract_xpath on a paper's own page,
+    cut after abstract_after if that is set. connections and interval limit how
+    hard its host is hit.
+    
+    Adding a journal is one register_source call; the GUI picks it up from there.
+    """
+    key: str
+    name: str
+    listing_url: str
+    parse_listing: Callable
+    abstract_xpath: str
+    abstract_after: str = None
+    first_pages: int = None # listing pages read at start-up; None means the GUI's page_depth
+    connections: int = connections_per_host
+    interval: float = host_interval
+    
+    
+    @property
+    def host(self):
+        return urllib.parse.urlsplit(self.listing_url).netloc
+    
+    
+    def page_url(self, page):
+        return self.listing_url.format(page=page)
+    
+    
+    def parse_abstract(self, html):
+        abstract = _html_tree(html).xpath(self.abstract_xpath)[0].text_content()
+        if self.abstract_after is not None:
+            abstract = abstract.split(self.abstract_after, 1)[1]
+        return abstract
+    
+
+class ArxivSource(Source):
+    # arXiv page 1 is the /new listing, which has no pages; later pages walk back through the past week
+    def page_url(self, page):
+        if page > 1:
+            return arxiv_history_url.format(skip=(page-2)*arxiv_page_size, show=arxiv_page_size)
+        return self.listing_url
+    
+
+
+sources = {}
+
+
+def register_source(source):
+    sources[source.key] = source
+    journal_names[source.key] = source.name
+    connections.set_limit(source.host, source.connections)
+    host_intervals[source.host] = source.interval
+    listing_prefix = source.listing_url.split('{')[0]
+    if not any(listing_prefix.startswith(prefix) for prefix in cache_ttls):
+        cache_ttls[listing_prefix] = listing_ttl
+    return source
+
+
+register_source(Source('prb', 'Physical Review B', 'https://journals.aps.org/prb/recent?page={page}',
+                       parse_PhysRevB_listing, '(//p)[1]'))
+register_source(Source('nat', 'Nature', 'https://www.nature.com/search?article_type=protocols%2Cresearch%2Creviews&subject=condensed-matter-physics&page={page}',
+                       parse_Nature_listing, '(//p)[5]'))
+register_source(ArxivSource('arx', 'arXiv', 'https://arxiv.org/list/cond-mat/new',
+                            parse_arXiv_listing, '(//blockquote)[1]', abstract_after='Abstract: ', first_pages=1))
+
+
+def _fetch(source, link, cache=None, limiter=None, deadline=None):
+    # one of a journal's pages, through its circuit breaker and the cache; an out of date
+    # copy beats none while the site cannot be reached
+    try:
+        if cache is not None:
+            return _guarded(source, lambda: cache.fetch(link, limiter, deadline))
+        if limiter is not None:
+            limiter.wait(link)
+        return _guarded(source, lambda: download(link, deadline=deadline)[2])
+    except (OSError, http.client.HTTPException):
+        html = cache.stale(link) if cache is not None else None
+        if html is None:
+            raise
+        return html
+
+
+def get_papers(source, page=1, cache=None, deadline=None, parser=None, limiter=None):
+    # downloads and parses one listing page, returning {id: Paper} in page order; the download
+    # waits its turn with limiter and the parsing is done in a process of parser, if they are given
+    journal = sources[source]
+    html = _fetch(source, journal.page_url(page), cache, limiter, deadline)
+    with span('parse listing', source=source, page=page, bytes=len(html), process=parser is not None) as parse_span:
+        papers = _parse_listing(journal, html, parser)
+        parse_span.set(papers=len(papers))
+    return papers
+
+
+# Parsing holds the GIL, so in a deep crawl it is done in a pool of processes instead of
+# on the fetch threads. The parser is sent by reference, which is why only one that can be
+# imported from its module is sent; the papers come back as plain tuples.
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def parse_pool():
+    # started on first use and shared from then on; None if there are too few cores for it to help
+    global _parse_pool
+    if parse_workers < 2:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawned rather than forked, as a fork would copy the fetch threads' locks mid-use
+            _parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context('spawn'),
+                                              initializer=_start_parse_process)
+        return _parse_pool
+
+
+def _start_parse_process():
+    # spans are only recorded in the main process, which times each parse as a whole
+    tracing.enabled = False
+
+
+def _parse_records(parse, html):
+    return [(paper.source, paper.id, paper.title, paper.authors, paper.link, paper.pubinfo, paper.abstract)
+            for paper in parse(html).values()]
+
+
+def _parse_listing(journal, html, parser=None):
+    global _parse_pool
+    parse = journal.parse_listing
+    if parser is not None and getattr(sys.modules.get(parse.__module__), parse.__qualname__, None) is parse:
+        try:
+            return {record[1]:Paper(*record) for record in parser.submit(_parse_records, parse, html).result()}
+        except BrokenProcessPool:
+            # a parse process died; this page is parsed here and the next deep crawl starts a new pool
+            with _parse_pool_lock:
+                if _parse_pool is parser:
+                    _parse_pool = None
+    return parse(html)
+
+
+def get_abstract(paper, cache=None, limiter=None):
+    html = _fetch(paper.source, paper.link, cache, limiter)
+    with span('parse abstract', source=paper.source, bytes=len(html)):
+        return sources[paper.source].parse_abstract(html)
+
+
+# Duplicates across journals, e.g. an arXiv preprint and its PRB version, are found
+# with MinHash signatures of the normalized title's character trigrams. Signatures are cut into bands and
+# bucketed (LSH), so a new paper is only compared with the few papers that share a
+# bucket with it, rather than with everything loaded so far.
+
+name_suffixes = {'jr', 'sr', 'ii', 'iii', 'iv'}
+
+
+def normalize_title(title):
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[a-z0-9]+', title.lower()))
+
+
+author_separators = re.compile(r',|;|&|\band\b|\n', re.IGNORECASE)
+
+
+def split_authors(authors):
+    # the journals list authors as 'A, B, and C' or one per line
+    names = [' '.join(name.split()) for name in author_separators.split(authors)]
+    return [name for name in names if name.strip('. ') != '' and name.lower().rstrip('.') != 'et al']
+
+
+def author_key(name):
+    # surname and first initial, lowercased and without accents, so that 'J. Smith' and
+    # 'Jöhn Smith' from different journals are the same author; a lone word is kept whole
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    words = [word for word in re.findall(r"[a-z]+(?:['-][a-z]+)*", name) if word not in name_suffixes]
+    if len(words) == 0:
+        return ''
+    if len(words) == 1:
+        return words[0]
+    return f'{words[-1]} {words[0][0]}'
+
+
+def author_surnames(authors):
+    return {author_key(name).split()[0] for name in split_authors(authors) if author_key(name) != ''}
+
+
+def _shingles(text):
+    if len(text) < 3:
+        return {text}
+    return {text[i:i+3] for i in range(len(text)-2)}
+
+
+class Deduplicator:
+    """
+    Merges papers that are the same work listed by different journals. The
+    paper seen first stays the record, so rows already on screen do not move,
+    and later versions are appended to its versions list. Titles must overlap
+    by dedup_threshold and the authors' surnames must overlap too, so that two
+    papers which merely share a stock title are kept apart.
+    """
+    def __init__(self, threshold=dedup_threshold, bands=minhash_bands, rows=minhash_rows):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        # each bin has its own fixed order of bins to borrow from when it is empty, so a band
+        # of empty bins draws on several different bins rather than all on the same neighbour
+        rng = random.Random(0)
+        self.donors = [rng.sample(range(bands*rows), bands*rows) for i in range(bands*rows)]
+        self.records = {} # id of every paper seen -> the record it belongs to
+        self.buckets = {}
+        self.features = {}
+    
+    
+    def signature(self, shingles):
+        # one-permutation MinHash: every shingle is hashed once into one of the bins, each bin
+        # keeps its smallest value, and an empty bin borrows from a bin that is not
+        size = self.bands*self.rows
+        bins = [None]*size
+        for shingle in shingles:
+            value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+            i, value = value % size, value // size
+            if bins[i] is None or value < bins[i]:
+                bins[i] = value
+        signature = []
+        for i in range(size):
+            if bins[i] is not None:
+                signature.append(bins[i])
+            else:
+                signature.append(next(bins[j] for j in self.donors[i] if bins[j] is not None))
+        return signature
+    
+    
+    def add(self, paper):
+        # returns the record paper belongs to: paper itself if it is new, or the earlier version it was merged into
+        if paper.id in self.records:
+            return self.records[paper.id]
+        shingles = _shingles(normalize_title(paper.title))
+        surnames = author_surnames(paper.authors)
+        signature = self.signature(shingles)
+        keys = [(band, tuple(signature[band*self.rows:(band+1)*self.rows])) for band in range(self.bands)]
+        record = self._match(paper, keys, shingles, surnames)
+        if record is None:
+            record = paper
+            self.features[paper.id] = (shingles, surnames)
+            for key in keys:
+                self.buckets.setdefault(key, []).append(paper)
+        else:
+            record.versions.append(paper)
+        self.records[paper.id] = record
+        return record
+    
+    
+    def _match(self, paper, keys, shingles, surnames):
+        checked = set()
+        for key in keys:
+            for candidate in self.buckets.get(key, ()):
+                if candidate.id in checked:
+                    continue
+                checked.add(candidate.id)
+                if candidate.source == paper.source or any(version.source == paper.source for version in candidate.versions):
+                    continue
+                candidate_shingles, candidate_surnames = self.features[candidate.id]
+                if len(shingles & candidate_shingles) < self.threshold*len(shingles | candidate_shingles):
+                    continue
+                if len(surnames) > 0 and len(candidate_surnames) > 0 and len(surnames & candidate_surnames) < min(len(surnames), len(candidate_surnames))/2:
+                    continue
+                return candidate
+        return None
+    
+
+
+def crawl(sources=None, pages=1, cache=None, workers=fetch_workers, deadline=None, limiter=None):
+    """
+    Fetches every page of every source in parallel and yields (source, page, papers)
+    as each page is parsed. A page that cannot be fetched, or not before the
+    deadline (a time.monotonic() time), is reported on stderr and skipped. The
+    pages of a crawl of more than parse_in_process_pages are parsed in processes.
+    Each host is read no faster than its source's interval allows.
+    """
+    if sources is None:
+        sources = list(journal_names)
+    jobs = [(source, page) for source in sources for page in range(1, pages+1)]
+    parser = parse_pool() if len(jobs) > parse_in_process_pages else None
+    limiter = limiter or HostLimiter(host_interval)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(get_papers, source, page, cache, deadline, parser, limiter):(source, page) for source, page in jobs}
+        for future in as_completed(futures):
+            source, page = futures[future]
+            try:
+                papers = future.result()
+            except Exception as error:
+                print(f'ERROR: Could not load page {page} of {journal_names[source]}: {error}', file=sys.stderr)
+                continue
+            yield source, page, papers
+
+
+def main(argv=None):
+    global parse_workers
+    parser = argparse.ArgumentParser(description='Stream the newest papers from each journal as JSON Lines.')
+    parser.add_argument('--journals', nargs='+', choices=list(journal_names), default=list(journal_names),
+                        help='which journals to read (default: all)')
+    parser.add_argument('--pages', type=int, default=1, help='how many pages of each journal to read')
+    parser.add_argument('--abstracts', action='store_true', help='also fetch the abstract of every paper')
+    parser.add_argument('--output', default='-', help='file to write to (default: stdout)')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the on-disk response cache')
+    parser.add_argument('--parse-workers', type=int, default=parse_workers, help='processes that parse the listing pages of a deep crawl (default: one per core but one; below 2, none)')
+    parser.add_argument('--deadline', type=float, help='seconds to allow for reading the listings; pages not read by then are skipped')
+    parser.add_argument('--trace', metavar='FILE', help='record timing spans and write them to FILE as Chrome trace events')
+    args = parser.parse_args(argv)
+    if args.trace:
+        tracing.enable(args.trace)
+    parse_workers = args.parse_workers
+    
+    cache = None if args.no_cache else ResponseCache(cache_path, cache_size)
+    limiter = HostLimiter(host_interval)
+    deadline = None if args.deadline is None else time.monotonic() + args.deadline
+    
+    def abstract(paper):
+        try:
+            return get_abstract(paper, cache, limiter)
+        except Exception as error:
+            print(f'ERROR: Could not get the abstract of {paper.link}: {error}', file=sys.stderr)
+            return ''
+    
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+            for source, page, papers in crawl(args.journals, args.pages, cache, deadline=deadline, limiter=limiter):
+                if args.abstracts:
+                    abstracts = pool.map(abstract, papers.values())
+                    for paper, abstract in zip(papers.values(), abstracts):
+                        paper.abstract = abstract
+                for paper in papers.values():
+                    out.write(json.dumps(dataclasses.asdict(paper)) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+My Library, the saved papers, with no GUI attached.
+
+Like journals.py, this needs neither tkinter nor a display, so a library can
+be moved on a server or from a script. Run it to import or export one:
+
+    python library.py --import zotero.bib papers.jsonl
+    python library.py --export library.csv
+
+
+@author: jgwillingham
+"""
+
+import csv
+import ast
+import re
+import sqlite3
+import os
+import itertools
+import argparse
+import json
+from journals import Paper, split_authors, author_key
+import tracing
+from tracing import traced
+
+
+import_batch_size = 1000 # papers written per statement when a library file is imported
+
+database_path = r'C:\Users\George Willingham\Repositories\stateofthefield\saved_papers_database.sqlite'
+csv_database_path = r'C:\Users\George Willingham\Repositories\stateofthefield\saved_papers_database.csv' # old library, imported into the one above on first run
+
+
+
+class Library:
+    """
+    The saved papers, kept in SQLite.
+    
+    Papers are unique by link and indexed by title. papers_fts is a full-text
+    table over title, authors and abstract that triggers keep in step with
+    the papers table. Saving and removing touch a single row. The authors
+    followed from the Filters panel are kept here too.
+    
+    Whole libraries move in and out as BibTeX, JSON Lines or CSV, chosen by
+    the file's extension. Both directions stream, one paper at a time, and
+    an import skips papers whose link is already saved.
+    """
+    columns = ('title', 'authors', 'link', 'pubinfo', 'abstract')
+    insert_trigger = '''CREATE TRIGGER IF NOT EXISTS papers_insert AFTER INSERT ON papers BEGIN
+                        INSERT INTO papers_fts (rowid, title, authors, abstract) VALUES (new.id, new.title, new.authors, new.abstract);
+                        END'''
+    
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS papers (id INTEGER PRIMARY KEY, title TEXT NOT NULL, authors TEXT, link TEXT NOT NULL UNIQUE, pubinfo TEXT, abstract TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS papers_title ON papers (title)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS followed_authors (key TEXT PRIMARY KEY, name TEXT NOT NULL)')
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(title, authors, abstract, content='papers', content_rowid='id')")
+            self.db.execute(self.insert_trigger)
+            self.db.execute('''CREATE TRIGGER IF NOT EXISTS papers_delete AFTER DELETE ON papers BEGIN
+                    INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract) VALUES ('delete', old.id, old.title, old.authors, old.abstract);
+                    END''')
+            self.db.execute('''CREATE TRIGGER IF NOT EXISTS papers_update AFTER UPDATE ON papers BEGIN
+                    INSERT INTO papers_fts (papers_fts, rowid, title, authors, abstract) VALUES ('delete', old.id, old.title, old.authors, old.abstract);
+                    INSERT INTO papers_fts (rowid, title, authors, abstract) VALUES (new.id, new.title, new.authors, new.abstract);
+                    END''')
+    
+    
+    @traced('library load')
+    def papers(self):
+        rows = self.db.execute('SELECT title, authors, link, pubinfo, abstract FROM papers ORDER BY id')
+        return [self._paper(row) for row in rows]
+    
+    
+    def _paper(self, row):
+        title, authors, link, pubinfo, abstract = row
+        return Paper('library', link, title, authors, link, pubinfo, abstract)
+    
+    
+    @traced('library save')
+    def save(self, paper):
+        # returns False if the paper was already in the library
+        with self.db:
+            cursor = self.db.execute('INSERT OR IGNORE INTO papers (title, authors, link, pubinfo, abstract) VALUES (?, ?, ?, ?, ?)',
+                                     [getattr(paper, column) for column in self.columns])
+        return cursor.rowcount == 1
+    
+    
+    @traced('library remove')
+    def remove(self, paper):
+        with self.db:
+            self.db.execute('DELETE FROM papers WHERE link=?', (paper.link,))
+    
+    
+    def followed_authors(self):
+        return dict(self.db.execute('SELECT key, name FROM followed_authors ORDER BY name'))
+    
+    
+    def follow(self, name):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO followed_authors (key, name) VALUES (?, ?)', (author_key(name), name))
+    
+    
+    def unfollow(self, name):
+        with self.db:
+            self.db.execute('DELETE FROM followed_authors WHERE key=?', (author_key(name),))
+    
+    
+    @traced('library search')
+    def search(self, query):
+        rows = self.db.execute('SELECT papers.title, papers.authors, papers.link, papers.pubinfo, papers.abstract '
+                               'FROM papers_fts JOIN papers ON papers.id = papers_fts.rowid '
+                               'WHERE papers_fts MATCH ? ORDER BY rank', (query,))
+        return [self._paper(row) for row in rows]
+    
+    
+    @traced('library import')
+    def import_file(self, path):
+        # returns how many papers were added
+        read = library_readers.get(os.path.splitext(path)[1].lower())
+        if read is None:
+            raise ValueError(f'{path} is not a .bib, .jsonl or .csv file')
+        added = 0
+        with open(path, 'r', encoding='utf-8', newline='') as library_file, self.db:
+            # the full-text index takes the new papers in one statement at the end, which is
+            # several times faster than the trigger adding them one by one
+            # sqlite3 only begins a transaction by itself before an INSERT, so it is begun here for
+            # the DROP to be rolled back with the inserts if the file turns out to be unreadable
+            self.db.execute('BEGIN')
+            last_id = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM papers').fetchone()[0]
+            self.db.execute('DROP TRIGGER IF EXISTS papers_insert')
+            rows = read(library_file)
+            while True:
+                batch = list(itertools.islice(rows, import_batch_size))
+                if len(batch) == 0:
+                    break
+                added += self.db.executemany('INSERT OR IGNORE INTO papers (title, authors, link, pubinfo, abstract) VALUES (?, ?, ?, ?, ?)', batch).rowcount
+            self.db.execute('INSERT INTO papers_fts (rowid, title, authors, abstract) SELECT id, title, authors, abstract FROM papers WHERE id > ?', (last_id,))
+            self.db.execute(self.insert_trigger)
+        return added
+    
+    
+    @traced('library export')
+    def export_file(self, path):
+        write = library_writers.get(os.path.splitext(path)[1].lower())
+        if write is None:
+            raise ValueError(f'{path} is not a .bib, .jsonl or .csv file')
+        with open(path, 'w', encoding='utf-8', newline='') as library_file:
+            write(library_file, self.db.execute('SELECT title, authors, link, pubinfo, abstract FROM papers ORDER BY id'))
+    
+    
+    def import_csv(self, path):
+        # one-time import of the old csv library, whose cells were written as b'...' byte reprs
+        if self.db.execute('PRAGMA user_version').fetchone()[0] > 0:
+            return
+        if os.path.exists(path):
+            with open(path, 'r', newline='') as db, self.db:
+                for row in csv.reader(db, dialect='excel'):
+                    row = [self._decode_cell(cell) for cell in row]
+                    self.db.execute('INSERT OR IGNORE INTO papers (title, authors, link, pubinfo, abstract) VALUES (?, ?, ?, ?, ?)', row[:5])
+        self.db.execute('PRAGMA user_version = 1')
+    
+    
+    @staticmethod
+    def _decode_cell(cell):
+        try:
+            return ast.literal_eval(cell).decode('utf-8')
+        except (ValueError, SyntaxError, AttributeError, UnicodeDecodeError):
+            return cell.split("b'", 1)[-1].rstrip("'")
+    
+
+
+# Library files. Readers take an open file and yield (title, authors, link, pubinfo, abstract)
+# rows, skipping papers without a title or a link; writers take an open file and such rows.
+
+def _library_row(title, authors, link, pubinfo, abstract):
+    row = tuple(' '.join(str(value or '').split()) for value in (title, authors, link, pubinfo)) + (str(abstract or '').strip(),)
+    if row[0] == '' or row[2] == '':
+        return None
+    return row
+
+
+def read_jsonl(library_file):
+    # also reads the papers that journals.py writes
+    for line in library_file:
+        if line.strip() != '':
+            paper = json.loads(line)
+            row = _library_row(*(paper.get(column) for column in Library.columns))
+            if row is not None:
+                yield row
+
+
+def write_jsonl(library_file, rows):
+    for row in rows:
+        library_file.write(json.dumps(dict(zip(Library.columns, row)), ensure_ascii=False) + '\n')
+
+
+def read_csv(library_file):
+    # a header row names the columns; files from before this format (b'...' cells, no header) are read too
+    reader = csv.reader(library_file, dialect='excel')
+    header = next(reader, None)
+    if header is None:
+        return
+    if [cell.strip().lower() for cell in header] == list(Library.columns):
+        for cells in reader:
+            row = _library_row(*(cells + ['']*5)[:5])
+            if row is not None:
+                yield row
+    else:
+        for cells in itertools.chain([header], reader):
+            row = _library_row(*(Library._decode_cell(cell) for cell in (cells + ['']*5)[:5]))
+            if row is not None:
+                yield row
+
+
+def write_csv(library_file, rows):
+    writer = csv.writer(library_file, dialect='excel')
+    writer.writerow(Library.columns)
+    writer.writerows(rows)
+
+
+bibtex_field_pattern = re.compile(r'\s*,?\s*([A-Za-z][\w-]*)\s*=\s*')
+bibtex_escapes = {'\\&':'&', '\\%':'%', '\\_':'_', '\\$':'$', '\\#':'#', '--':'\u2013', '~':' '}
+bibtex_brace_pattern = re.compile(r'[{}]')
+
+
+def _bibtex_entries(library_file):
+    # yields the text of each @entry{...}, read a line at a time until its braces close
+    entry = None
+    depth = 0
+    for line in library_file:
+        if entry is None:
+            start = line.find('@')
+            if start < 0:
+                continue
+            entry = []
+            line = line[start:]
+        entry.append(line)
+        depth += line.count('{') - line.count('}')
+        if depth <= 0 and '{' in ''.join(entry):
+            yield ''.join(entry)
+            entry = None
+            depth = 0
+
+
+def _bibtex_fields(entry):
+    # fields of one entry, lowercased: {braced}, "quoted" or bare values
+    fields = {}
+    body = entry[entry.index('{')+1:]
+    position = body.find(',') + 1
+    while True:
+        match = bibtex_field_pattern.match(body, position)
+        if match is None:
+            break
+        position = match.end()
+        if body.startswith('{', position):
+            depth = 0
+            end = len(body)
+            for brace in bibtex_brace_pattern.finditer(body, position):
+                depth += 1 if brace.group() == '{' else -1
+                if depth == 0:
+                    end = brace.start()
+                    break
+            value = body[position+1:end]
+            position = end + 1
+        elif body.startswith('"', position):
+            end = body.find('"', position+1)
+            end = len(body) if end < 0 else end
+            value = body[position+1:end]
+            position = end + 1
+        else:
+            end = position
+            while end < len(body) and body[end] not in ',}':
+                end += 1
+            value = body[position:end].strip()
+            position = end
+        fields[match.group(1).lower()] = value
+    return fields
+
+
+def _bibtex_text(value):
+    for escape, text in bibtex_escapes.items():
+        value = value.replace(escape, text)
+    return ' '.join(value.replace('{', '').replace('}', '').split())
+
+
+def read_bibtex(library_file):
+    for entry in _bibtex_entries(library_file):
+        if entry.lstrip('@').lower().startswith(('comment', 'string', 'preamble')):
+            continue
+        fields = {name:_bibtex_text(value) for name, value in _bibtex_fields(entry).items()}
+        link = fields.get('url', '')
+        if link == '' and fields.get('doi', '') != '':
+            link = 'https://doi.org/' + fields['doi']
+        if link == '' and fields.get('eprint', '') != '':
+            link = 'https://arxiv.org/abs/' + fields['eprint']
+        # names are written 'First Last' or 'Last, First' (or 'Last, Jr., First')
+        names = []
+        for name in re.split(r'\s+and\s+', fields.get('author', '')):
+            parts = [part.strip() for part in name.split(',')]
+            names.append(' '.join(parts[2:] + parts[:1] + parts[1:2]) if len(parts) == 3 else ' '.join(reversed(parts)))
+        authors = ', '.join(name for name in names if name != '')
+        pubinfo = ', '.join(fields[name] for name in ('journal', 'booktitle', 'volume', 'pages', 'year') if fields.get(name, '') != '')
+        pubinfo = pubinfo or fields.get('note', '')
+        row = _library_row(fields.get('title'), authors, link, pubinfo, fields.get('abstract'))
+        if row is not None:
+            yield row
+
+
+def _bibtex_value(text):
+    # braces must pair up inside a braced value, so any that do not are dropped
+    if text.count('{') != text.count('}'):
+        text = text.replace('{', '').replace('}', '')
+    for escape, character in bibtex_escapes.items():
+        if escape.startswith('\\'):
+            text = text.replace(character, escape)
+    return '{' + text + '}'
+
+
+def write_bibtex(library_file, rows):
+    # keys are the first author's surname and the year, with a count after any that repeat
+    keys = {}
+    for title, authors, link, pubinfo, abstract in rows:
+        names = split_authors(authors or '')
+        key = re.sub(r'\W', '', author_key(names[0]).split(' ')[0] if names else '') or 'paper'
+        year = re.findall(r'\b(?:19|20)\d\d\b', pubinfo or '')
+        key += year[-1] if year else ''
+        keys[key] = keys.get(key, 0) + 1
+        if keys[key] > 1:
+            key += f'_{keys[key]}'
+        fields = [('title', title), ('author', ' and '.join(names)), ('note', pubinfo), ('url', link), ('abstract', abstract)]
+        library_file.write(f'@article{{{key},\n')
+        library_file.write(''.join(f'  {name} = {_bibtex_value(value)},\n' for name, value in fields if value))
+        library_file.write('}\n\n')
+
+
+library_readers = {'.bib':read_bibtex, '.jsonl':read_jsonl, '.csv':read_csv}
+library_writers = {'.bib':write_bibtex, '.jsonl':write_jsonl, '.csv':write_csv}
+library_file_types = [('BibTeX', '*.bib'), ('JSON Lines', '*.jsonl'), ('CSV', '*.csv')]
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import papers into My Library, or export it.')
+    parser.add_argument('--import', dest='import_files', metavar='FILE', nargs='+', help='add the papers in these .bib, .jsonl or .csv files')
+    parser.add_argument('--export', metavar='FILE', help='write My Library to a .bib, .jsonl or .csv file')
+    parser.add_argument('--trace', metavar='FILE', help='record timing spans and write them to FILE as Chrome trace events')
+    args = parser.parse_args(argv)
+    if args.trace:
+        tracing.enable(args.trace)
+    
+    library = Library(database_path)
+    for path in args.import_files or []:
+        print(f'{library.import_file(path)} papers imported from {path}')
+    if args.export:
+        library.export_file(args.export)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Searching and ranking the loaded papers, with no GUI attached.
+
+The app's list is filtered with SearchIndex and AuthorIndex and sorted with
+LibraryRanker, and AbstractStore bounds the memory the abstracts take. None
+of them needs tkinter, so they can be timed and used without a display.
+
+
+@author: jgwillingham
+"""
+
+import re
+import math
+import bisect
+import collections
+import heapq
+import numpy as np
+from scipy import sparse
+from journals import split_authors, author_key
+
+
+author_suggestions = 8 # names offered while a by: term is typed
+
+
+word_pattern = re.compile(r'\w+')
+query_pattern = re.compile(r'(?:(\w+):)?(?:"([^"]*)"?|(\S+))')
+author_term_pattern = re.compile(r'\bby:(?:"([^"]*)("?)|(\S+))', re.IGNORECASE)
+
+
+def tokenize(text):
+    return word_pattern.findall(text.lower())
+
+
+def has_or(query):
+    # whether the query joins groups of terms with OR, read the way SearchIndex.parse reads it
+    return any(field == '' and word in ('OR', '|') for field, phrase, word in query_pattern.findall(query))
+
+
+def narrows(last_query, query):
+    """
+    Whether every paper matching query also matches last_query, so that query
+    only has to be searched among the hits of last_query. That holds when query
+    only adds words or letters, neither query has OR groups and no field prefix
+    or quote is opened or left open where the text was added.
+    """
+    if not query.startswith(last_query) or has_or(last_query) or has_or(query):
+        return False
+    added = query[len(last_query):]
+    # a field prefix or quote left open at the end of the last query was searched as a plain word
+    return not last_query.endswith((':', '"')) and ':' not in added and '"' not in added
+
+
+
+class SearchIndex:
+    """
+    Inverted index over the title, authors and abstract of every loaded paper.
+    
+    Queries are made of terms that must all match (AND). Groups of terms can be
+    joined with OR, a term can be limited to one field with a prefix
+    (title:, author:, abstract:) and "quoted words" must appear together.
+    Words match any indexed word they are the start of, so partially typed
+    words still find papers. Results are ranked by tf-idf.
+    """
+    field_weights = {'title':3.0, 'authors':2.0, 'abstract':1.0}
+    field_prefixes = {'title':'title', 'author':'authors', 'authors':'authors', 'abstract':'abstract'}
+    
+    def __init__(self, texts=None):
+        self.docs = {}
+        self.texts = texts or self._texts # reads a field of many papers, for the phrases the postings cannot check
+        self.postings = {field:{} for field in self.field_weights}
+        self.vocabulary = {field:None for field in self.field_weights}
+        self.doc_tokens = {}
+        self.version = 0 # changes whenever what a query could match changes
+    
+    
+    def add(self, paper):
+        if paper.id in self.docs:
+            self.remove(paper.id)
+        self.docs[paper.id] = paper
+        for field in self.field_weights:
+            self._index_field(paper.id, field, getattr(paper, field))
+    
+    
+    def update(self, paper, field):
+        # used when more text becomes known for a paper, e.g. a fetched abstract
+        if self.docs.get(paper.id) is paper:
+            self._unindex_field(paper.id, field)
+            self._index_field(paper.id, field, getattr(paper, field))
+    
+    
+    def remove(self, key):
+        for field in self.field_weights:
+            self._unindex_field(key, field)
+        del self.docs[key]
+    
+    
+    def _index_field(self, key, field, text):
+        self.version += 1
+        counts = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        self.doc_tokens[(key, field)] = counts
+        postings = self.postings[field]
+        for token, count in counts.items():
+            if token not in postings:
+                postings[token] = {}
+                self.vocabulary[field] = None
+            postings[token][key] = count
+    
+    
+    def _unindex_field(self, key, field):
+        self.version += 1
+        postings = self.postings[field]
+        for token in self.doc_tokens.pop((key, field), {}):
+            del postings[token][key]
+            if len(postings[token]) == 0:
+                del postings[token]
+                self.vocabulary[field] = None
+    
+    
+    def _expand(self, field, word):
+        # all indexed words starting with word, found by bisecting the sorted vocabulary
+        if self.vocabulary[field] is None:
+            self.vocabulary[field] = sorted(self.postings[field])
+        vocabulary = self.vocabulary[field]
+        start = bisect.bisect_left(vocabulary, word)
+        end = bisect.bisect_left(vocabulary, word + '\uffff')
+        return vocabulary[start:end]
+    
+    
+    def _tokens(self, field, word, prefix):
+        if prefix:
+            return self._expand(field, word)
+        return [word] if word in self.postings[field] else []
+    
+    
+    def _size(self, fields, word, prefix):
+        # how many postings a word would go through, to match the rarest words first
+        return sum(len(self.postings[field][token]) for field in fields for token in self._tokens(field, word, prefix))
+    
+    
+    def _match_word(self, fields, word, prefix, within):
+        scores = {}
+        for field in fields:
+            postings = self.postings[field]
+            for token in self._tokens(field, word, prefix):
+                docs = postings[token]
+                weight = self.field_weights[field]*math.log(1 + len(self.docs)/len(docs))
+                if within is None:
+                    for key, count in docs.items():
+                        scores[key] = scores.get(key, 0) + weight*count
+                elif len(within) < len(docs):
+                    for key in within:
+                        if key in docs:
+                            scores[key] = scores.get(key, 0) + weight*docs[key]
+                else:
+                    for key, count in docs.items():
+                        if key in within:
+                            scores[key] = scores.get(key, 0) + weight*count
+        return scores
+    
+    
+    def _match_term(self, fields, words, is_phrase, within):
+        # the last word of a term is matched as a prefix, the others exactly
+        last = len(words) - 1
+        matches = [(word, i == last) for i, word in enumerate(words)]
+        scores = self._intersect([lambda within, word=word, prefix=prefix: self._match_word(fields, word, prefix, within)
+                                  for word, prefix in sorted(matches, key=lambda match: self._size(fields, *match))], within)
+        if is_phrase and len(words) > 1:
+            # the words in order with only non-word characters between them, as tokenize splits them
+            phrase = re.compile(r'\W+'.join(re.escape(word) for word in words), re.IGNORECASE)
+            keys = list(scores)
+            texts = [self.texts([self.docs[key] for key in keys], field) for field in fields]
+            scores = {key:scores[key] for i, key in enumerate(keys) if any(phrase.search(field_texts[i]) for field_texts in texts)}
+        return scores
+    
+    
+    @staticmethod
+    def _texts(papers, field):
+        return [getattr(paper, field) for paper in papers]
+    
+    
+    def _intersect(self, matchers, within):
+        # runs the matchers in turn, each only over the papers every earlier one matched,
+        # so a rare word up front keeps the common ones after it cheap
+        scores = None
+        for matcher in matchers:
+            match = matcher(within if scores is None else scores)
+            scores = match if scores is None else {key:score + match[key] for key, score in scores.items() if key in match}
+            if len(scores) == 0:
+                break
+        return scores or {}
+    
+    
+    def parse(self, query):
+        groups = [[]]
+        for field, phrase, word in query_pattern.findall(query):
+            if word in ('OR', '|') and field == '':
+                groups.append([])
+                continue
+            if field.lower() in self.field_prefixes:
+                fields = [self.field_prefixes[field.lower()]]
+            else:
+                fields = list(self.field_weights)
+                if field != '':
+                    word = field + ':' + word
+            words = tokenize(phrase if phrase else word)
+            if len(words) > 0:
+                groups[-1].append((fields, words, phrase != '' or len(words) > 1))
+        return [group for group in groups if len(group) > 0]
+    
+    
+    def search(self, query, within=None):
+        # returns the ids of the matching papers, best match first, or None for an empty query;
+        # within limits the search to a set of ids, e.g. papers that have just been loaded
+        groups = self.parse(query)
+        if len(groups) == 0:
+            return None
+        scores = {}
+        for group in groups:
+            group = sorted(group, key=lambda term: min(self._size(term[0], word, i == len(term[1])-1) for i, word in enumerate(term[1])))
+            for key, score in self._intersect([lambda within, term=term: self._match_term(*term, within) for term in group], within).items():
+                scores[key] = scores.get(key, 0) + score
+        return sorted(scores, key=scores.get, reverse=True)
+    
+
+
+class AuthorIndex:
+    """
+    The authors of every loaded and saved paper, one entry per person.
+    
+    Names are split out of each paper's author list and filed under
+    author_key, so 'J. Smith' and 'John Smith' listed by two journals are the
+    same author. Keys are kept sorted, as the words of SearchIndex are, so a
+    partly typed surname finds every author it could be the start of.
+    """
+    def __init__(self):
+        self.papers = {} # key -> ids of the papers by that author
+        self.names = {} # key -> the name as it was first listed
+        self.paper_keys = {}
+        self.keys = None
+        self.name_keys = {} # the same names come up paper after paper, so each is normalized once
+    
+    
+    def add(self, paper):
+        if paper.id in self.paper_keys:
+            self.remove(paper.id)
+        keys = []
+        for name in split_authors(paper.authors):
+            key = self.name_keys.get(name)
+            if key is None:
+                key = self.name_keys[name] = author_key(name)
+            if key == '' or key in keys:
+                continue
+            keys.append(key)
+            if key not in self.papers:
+                self.papers[key] = set()
+                self.names[key] = name
+                self.keys = None
+            self.papers[key].add(paper.id)
+        self.paper_keys[paper.id] = keys
+    
+    
+    def remove(self, paper_id):
+        for key in self.paper_keys.pop(paper_id, []):
+            self.papers[key].discard(paper_id)
+            if len(self.papers[key]) == 0:
+                del self.papers[key]
+                del self.names[key]
+                self.keys = None
+    
+    
+    def _matching(self, name, prefix):
+        # a full name matches that author; a surname alone matches everyone with that surname
+        surname, _, initial = author_key(name).partition(' ')
+        if surname == '':
+            return []
+        if self.keys is None:
+            self.keys = sorted(self.papers)
+        start = bisect.bisect_left(self.keys, surname)
+        end = bisect.bisect_left(self.keys, surname + ('\uffff' if prefix else ' \uffff'))
+        keys = self.keys[start:end]
+        if initial != '':
+            keys = [key for key in keys if key.partition(' ')[2] == initial]
+        return keys
+    
+    
+    def papers_by(self, name, prefix=False):
+        ids = set()
+        for key in self._matching(name, prefix):
+            ids |= self.papers[key]
+        return ids
+    
+    
+    def complete(self, name, limit=author_suggestions):
+        # the authors a partly typed name could be, those with the most papers first
+        keys = heapq.nlargest(limit, self._matching(name, prefix=True), key=lambda key: len(self.papers[key]))
+        return [self.names[key] for key in keys]
+    
+
+
+class LibraryRanker:
+    """
+    Scores papers by how much they resemble the papers saved in My Library.
+    
+    Papers become tf-idf vectors over the words of their title, authors and
+    abstract, weighted by field as in the search, with the idf taken from the
+    library. The library's profile is the mean of its papers' unit vectors, and
+    a batch of papers is scored in one sparse matrix product as the cosine
+    between each paper and that profile.
+    """
+    max_df = 0.5 # words in more than this share of the saved papers say nothing about its topics
+    
+    def __init__(self, saved_papers):
+        counts = [self._counts(paper) for paper in saved_papers]
+        size = len(counts)
+        # the last two columns stand for words to ignore and words the library has never seen:
+        # unseen words count toward a paper's length but never match, so a paper that is
+        # mostly about something else scores low
+        self.vocabulary = {field:{} for field in SearchIndex.field_weights}
+        idf = []
+        ignored = []
+        for field, vocabulary in self.vocabulary.items():
+            doc_freqs = collections.Counter(token for paper_counts in counts for token in paper_counts[field])
+            for token, doc_freq in doc_freqs.items():
+                if (doc_freq > 1 and doc_freq > self.max_df*size) or (field == 'authors' and len(token) < 2):
+                    ignored.append((vocabulary, token))
+                else:
+                    vocabulary[token] = len(idf)
+                    idf.append(math.log((size + 1)/(doc_freq + 1)) + 1)
+        self.ignored = len(idf)
+        self.unseen = len(idf) + 1
+        for vocabulary, token in ignored:
+            vocabulary[token] = self.ignored
+        self.idf = np.array(idf + [0.0, math.log(size + 1) + 1])
+        self.profile = np.zeros(len(self.idf))
+        if size > 0:
+            self.profile = np.asarray(self._vectors(counts).sum(axis=0)).ravel()/size
+    
+    
+    def _counts(self, paper, index=None):
+        # papers in the search index were tokenized when they were added
+        if index is not None and paper.id in index.docs:
+            return {field:index.doc_tokens.get((paper.id, field), {}) for field in SearchIndex.field_weights}
+        return {field:collections.Counter(tokenize(getattr(paper, field))) for field in SearchIndex.field_weights}
+    
+    
+    def _vectors(self, counts):
+        # one row of unit length per paper
+        rows = []
+        columns = []
+        weights = []
+        for field, field_weight in SearchIndex.field_weights.items():
+            vocabulary = self.vocabulary[field]
+            rows.append(np.repeat(np.arange(len(counts)), [len(paper_counts[field]) for paper_counts in counts]))
+            columns.append(np.array([vocabulary.get(token, self.unseen) for paper_counts in counts for token in paper_counts[field]], dtype=np.int64))
+            weights.append(field_weight*(1 + np.log(np.array([count for paper_counts in counts for count in paper_counts[field].values()], dtype=float))))
+        columns = np.concatenate(columns)
+        weights = np.concatenate(weights)*self.idf[columns]
+        vectors = sparse.csr_matrix((weights, (np.concatenate(rows), columns)), shape=(len(counts), len(self.idf)))
+        lengths = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        lengths[lengths == 0] = 1
+        return sparse.diags(1/lengths) @ vectors
+    
+    
+    def scores(self, papers, index=None):
+        papers = list(papers)
+        if len(papers) == 0:
+            return {}
+        scores = self._vectors([self._counts(paper, index) for paper in papers]) @ self.profile
+        return dict(zip((paper.id for paper in papers), scores.tolist()))
+    
+
+
+class AbstractStore:
+    """
+    Keeps the abstracts that were used most recently in memory, up to max_size
+    characters in all.
+    
+    Older abstracts are dropped from their papers, which then hold None, and
+    are read back from the archive when they are wanted again. The search
+    index keeps the words of every abstract, so search doesn't need the text.
+    Only a quoted phrase reads the text back, and it does not keep it.
+    """
+    def __init__(self, archive, max_size):
+        self.archive = archive
+        self.max_size = max_size
+        self.size = 0
+        self.papers = collections.OrderedDict() # id -> paper, least recently used first
+    
+    
+    def add(self, paper):
+        # paper.abstract has just been filled in
+        if paper.id in self.papers:
+            self.size -= len(self.papers.pop(paper.id).abstract or '')
+        self.papers[paper.id] = paper
+        self.size += len(paper.abstract)
+        while self.size > self.max_size and len(self.papers) > 1:
+            key, evicted = self.papers.popitem(last=False)
+            self.size -= len(evicted.abstract)
+            evicted.abstract = None
+    
+    
+    def text(self, paper):
+        # '' if the abstract has not been fetched yet, or has to be fetched again
+        if paper.abstract is None:
+            paper.abstract = self.archive.abstracts([paper.id]).get(paper.id) or ''
+            if paper.abstract != '':
+                self.add(paper)
+        elif paper.id in self.papers:
+            self.papers.move_to_end(paper.id)
+        return paper.abstract
+    
+    
+    def texts(self, papers):
+        # for a search, which reads the evicted abstracts back in one go without keeping them
+        archived = self.archive.abstracts([paper.id for paper in papers if paper.abstract is None])
+        return [archived.get(paper.id) or '' if paper.abstract is None else paper.abstract for paper in papers]
@@ -2,7 +2,7 @@
 """
 Created on Tue Mar 27 19:07:49 2018
 
-This is a tool for finding recently published papers. It uses Beautiful Soup to parse through the HTML of
+This is a tool for finding recently published papers. It uses lxml to parse through the HTML of
 particular webpages for scientific journals where the recent publications are listed. 
 Within the program, there is a search function for filtering the results.
 
@@ -16,10 +16,23 @@ Supported Journals include:
 """
 
 import tkinter as tk
-import urllib.request as url
-from bs4 import BeautifulSoup
+from tkinter import filedialog
 import webbrowser
-import csv
+import queue
+import math
+import sqlite3
+import threading
+import itertools
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from journals import Paper, ResponseCache, PaperArchive, HostLimiter, Deduplicator, get_papers, get_abstract, journal_names, sources, breakers, parse_pool, parse_in_process_pages
+from journals import author_key
+from search import SearchIndex, AuthorIndex, LibraryRanker, AbstractStore, author_term_pattern, author_suggestions, narrows
+from library import Library, library_file_types, database_path, csv_database_path
+from journals import fetch_workers, host_interval, cache_path, cache_size, archive_path, archive_age
+import tracing
+from tracing import span, traced
 
 
 papers_bg = 'white'
@@ -41,8 +54,17 @@ filters_font = ('Times New Roman', 15, 'underline')
 filters_list_font = ('Times New Roman', 12)
 
 page_depth = 1 # how many pages of each journal should be searched through
-
-database_path = r'C:\Users\George Willingham\Repositories\stateofthefield\saved_papers_database.csv'
+row_height = 120 # pixels given to each paper in the list
+library_row_height = 80 # pixels given to each paper in My Library
+header_height = 60 # pixels given to each journal heading in the list
+sync_deadline = 20 # seconds the startup sync may take before the journals still loading are given up on
+max_authors_length = 300 # longer author lists are cut short in the list (the full list is shown on selection)
+poll_interval = 50 # ms between checks for newly fetched pages
+search_delay = 30 # ms of quiet after a keystroke before the list is filtered, so bursts of typing search once
+live_search_min_length = 2 # shorter queries only search on Return, since they match nearly everything
+abstract_workers = 4 # threads fetching abstracts in the background
+hover_prefetch_delay = 300 # ms the pointer must rest on a paper before its abstract jumps the queue
+abstract_memory = 8*2**20 # characters of abstract text kept in memory; the rest are read back from the archive
     
 
 
@@ -74,329 +96,466 @@ class Papers(tk.Canvas):
     def __init__(self, parent, root):
         tk.Canvas.__init__(self, parent, bg=papers_bg)
         self.root = root
-        self.hovering = {}
-        self.selection = {}
+        self.hovering = None
+        self.hover_prefetch = None
+        self.selection = None
+        self.abstract_viewer = None
 
-        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar = tk.Scrollbar(self, command=self._yview)
         self.scrollbar.pack(side='left', fill='y')
         root.bind_all('<MouseWheel>', self._on_mouse_wheel)
         self.bind('<Enter>', self._scroll_papers)
         self.configure(yscrollcommand = self.scrollbar.set)
         self.bind('<Configure>', self._on_configure)
         
+        # the list is virtual: only the rows in view get widgets, and those
+        # widgets are handed to other papers as the list scrolls
+        self.sections = {source:{'source':source, 'papers':[], 'shown':True} for source in journal_names}
+        self.rows = []
+        self.pages_read = {source:0 for source in journal_names}
+        self.journal_labels = {}
+        self.retry_buttons = {}
+        self.error_labels = {}
+        self.headers = {}
+        for source, name in journal_names.items():
+            # a journal that could not be loaded keeps its heading, with the error and a way to try again
+            header = tk.Frame(self, bg=papers_bg)
+            self.journal_labels[source] = tk.Label(header, text=f'\t{name}\n', font=journals_font, bg=papers_bg)
+            self.journal_labels[source].pack(side='left', anchor='n')
+            self.retry_buttons[source] = tk.Button(header, text='Retry', command=lambda source=source: self._retry(source), bg=button_color, font=authors_font)
+            self.error_labels[source] = tk.Label(header, font=authors_font, bg=papers_bg, fg='red4')
+            self.headers[source] = self.create_window(0, 0, window=header, anchor='nw', state='hidden')
+        
+        # pages are downloaded and parsed on worker threads; the results come back
+        # through self.fetched, which is drained from the Tk thread with after()
+        self.journals = {source:{} for source in journal_names}
+        self.fetcher = ThreadPoolExecutor(max_workers=fetch_workers)
+        self.fetched = queue.Queue()
+        self.cache = ResponseCache(cache_path, cache_size)
+        self.index = SearchIndex(texts=self._field_texts)
+        self.author_index = AuthorIndex()
+        for paper in root.elements[Filters].db_handler.saved_papers.values():
+            self.author_index.add(paper)
+        self.dedup = Deduplicator()
+        self.archive = PaperArchive(archive_path, archive_age)
+        self.abstracts = AbstractStore(self.archive, abstract_memory)
+        self.synced = {source:0 for source in journal_names}
+        self.syncing = set()
+        self.failed = {}
+        self.deadlines = {} # source -> when its sync is given up on; None for a retry by hand
+        self.parsers = {} # source -> the processes its sync pages are parsed in; None for the fetch threads
+        self.offline_message = None
+        self.loading_more = False
+        self.prefetching = False
+        self.next_pages = None
+        self.after(poll_interval, self._drain_fetched)
+        
+        # abstracts are filled in by a few background threads, papers in view first
+        self.abstract_requests = queue.PriorityQueue()
+        self.abstract_order = itertools.count()
+        self.abstract_lock = threading.Lock()
+        self.abstracts_claimed = set()
+        self.abstracts_prioritized = set()
+        self.abstract_wanted = None
+        self.limiter = HostLimiter(host_interval)
+        for i in range(abstract_workers):
+            threading.Thread(target=self._abstract_worker, daemon=True).start()
         
-        self.frame = tk.Frame(self, bg=papers_bg)
-        self.create_window((0,0), window=self.frame, anchor='nw')
         print('getting publications')
+        # the papers seen before are shown straight from the archive, then synced with the journals
+        self.root.bind('<Button-1>', self._select_paper)
+        self.fetcher.submit(self._load_archive)
+    
+    
+    def _fetch_pages(self, jobs, on_done, deadline=None, parser=None):
+        batch = {'pending':len(jobs), 'results':{}, 'on_done':on_done, 'deadline':deadline, 'parser':parser}
+        for source, page in jobs:
+            self.fetcher.submit(self._fetch_page, batch, source, page)
+    
+    
+    def _fetch_page(self, batch, source, page):
+        # runs on a worker thread, so it must not touch any widgets
         try:
-            self.prb_pages_read = 0
-            self.nat_pages_read = 0
-            self._get_PhysRevB_papers(num_pages=page_depth)
-            self._get_Nature_papers(num_pages=page_depth)
-            self.nat_papers_read = page_depth
-            self._get_arXiv_papers()
-            isConnected = True
-        except:
+            with span('page', source=source, page=page):
+                papers = get_papers(source, page, self.cache, batch['deadline'], batch['parser'], self.limiter)
+                self.archive.add(page, papers)
+        except Exception as error:
+            papers = error
+        self.fetched.put((self._on_page_fetched, (batch, source, page, papers)))
+    
+    
+    def _drain_fetched(self):
+        # the worker threads hand their results to the Tk thread through self.fetched
+        while True:
+            try:
+                callback, args = self.fetched.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+        self.after(poll_interval, self._drain_fetched)
+    
+    
+    def _on_page_fetched(self, batch, source, page, papers):
+        batch['results'][(source, page)] = papers
+        batch['pending'] -= 1
+        if batch['pending'] == 0:
+            batch['on_done'](batch['results'])
+    
+    
+    @traced('merge')
+    def _merge_pages(self, results, fresh=False):
+        # returns the papers that were not loaded before, by source; fresh papers from
+        # the sync go above the archived ones rather than after them
+        new_papers = {source:[] for source in self.journals}
+        for source, page in sorted(results.keys()):
+            papers = results[(source, page)]
+            if isinstance(papers, Exception):
+                print(f'ERROR: Could not load page {page} of {journal_names[source]}: {papers}')
+                continue
+            for paper in papers.values():
+                if paper.id in self.dedup.records:
+                    continue
+                if self.dedup.add(paper) is not paper:
+                    # the same work is already listed from another journal, which now links here too
+                    continue
+                self.journals[source][paper.id] = paper
+                new_papers[source].append(paper)
+                self.index.add(paper)
+                self.author_index.add(paper)
+                if paper.abstract != '' and page > 0:
+                    self.abstracts.add(paper)
+                self._request_abstract(paper, priority=3)
+            self.pages_read[source] = max(self.pages_read[source], page)
+        if fresh:
+            for source, papers in new_papers.items():
+                listed = list(self.journals[source].items())
+                cut = self.synced[source]
+                added = len(listed) - len(papers)
+                self.journals[source] = dict(listed[:cut] + listed[added:] + listed[cut:added])
+                self.synced[source] += len(papers)
+        return new_papers
+    
+    
+    def _sync_parser(self, synced):
+        # a sync reads each journal a page at a time, but as a whole it is a crawl of up to this many pages;
+        # only one bigger than a small crawl pays for starting the parse processes, which are spawned
+        # and so import this module, tkinter and numpy included, before parsing
+        pages = sum(sources[source].first_pages or page_depth for source in synced)
+        return parse_pool() if pages > parse_in_process_pages else None
+    
+    
+    def _load_archive(self):
+        # runs on a worker thread
+        self.fetched.put((self._on_archive_loaded, (self.archive.papers(),)))
+    
+    
+    def _on_archive_loaded(self, archived):
+        self._merge_pages({(source, 0):papers for source, papers in archived.items() if source in self.journals})
+        # the archive lists each journal newest first, so its abstracts go into the store from the
+        # bottom of every journal up, and the rows at the top of the list are the last to be evicted
+        listed = [list(papers.values()) for papers in self.journals.values()]
+        for i in reversed(range(max(map(len, listed), default=0))):
+            for papers in listed:
+                if i < len(papers) and papers[i].abstract != '':
+                    self.abstracts.add(papers[i])
+        self.root.elements[Filters].refresh()
+        # the sync reads through each journal's pages only until it reaches papers that are already listed;
+        # the whole of it shares one deadline, so a slow journal cannot hold back the rest
+        deadline = time.monotonic() + sync_deadline
+        parser = self._sync_parser(self.journals)
+        for source in self.journals:
+            self.syncing.add(source)
+            self.deadlines[source] = deadline
+            self.parsers[source] = parser
+            self._fetch_pages([(source, 1)], self._on_page_synced, deadline, parser)
+        self.after(sync_deadline*1000, self._on_sync_deadline)
+    
+    
+    def _on_page_synced(self, results):
+        (source, page), papers = next(iter(results.items()))
+        caught_up = isinstance(papers, Exception) or len(papers) == 0 or any(paper.id in self.dedup.records for paper in papers.values())
+        # only the sync says whether a journal could be loaded; a prefetch may be older than a retry
+        if page == 1 and isinstance(papers, Exception):
+            self._set_failed(source, str(papers) or type(papers).__name__)
+        elif page == 1 and source in self.failed:
+            self._set_failed(source, None)
+        self._merge_pages(results, fresh=True)
+        self.root.elements[Filters].refresh()
+        if source not in self.syncing:
+            # the deadline passed while this page was on its way; its papers are still listed
+            return
+        if not caught_up and page < (sources[source].first_pages or page_depth):
+            self._fetch_pages([(source, page+1)], self._on_page_synced, self.deadlines[source], self.parsers[source])
+            return
+        self.syncing.discard(source)
+        if len(self.syncing) == 0:
+            self._on_synced()
+    
+    
+    def _on_sync_deadline(self):
+        # a journal retried by hand has no deadline and is left to finish
+        expired = [source for source in self.syncing if self.deadlines[source] is not None]
+        if len(expired) == 0:
+            return
+        for source in expired:
+            print(f'ERROR: {journal_names[source]} did not load within {sync_deadline}s')
+            if len(self.journals[source]) == 0:
+                self._set_failed(source, 'timed out')
+            self.syncing.discard(source)
+        self._layout()
+        if len(self.syncing) == 0:
+            self._on_synced()
+    
+    
+    def _on_synced(self):
+        if len(self.failed) == len(self.journals):
             print('ERROR: Could not connect to host')
-            message = tk.Label(self, text='\n\nNo Internet Connection', bg=papers_bg)
-            message.pack()
-            isConnected = False
-
-        if isConnected:
-            root.bind('<Button-1>', self._select_paper)
-            self.row = 0
-            self.labels = {}
-            print('displaying publications')
-            self.show_papers(self.prb_papers)
-            self.show_papers(self.nat_papers)
-            self.show_papers(self.arx_papers)
-            self.scrollbar.tkraise()
-            print('\nDONE')
-    
-    
-    def _get_PhysRevB_papers(self, start_page=1, num_pages=1):
-        print('opening Physical Review B . . .')
-        prb_titles = []
-        prb_authors = []
-        prb_links = []
-        prb_pubinfo = []
-        for page in range(start_page, start_page+num_pages):
-            print(f'\tparsing page {page} . . .')
-            prb_html = url.urlopen(f'https://journals.aps.org/prb/recent?page={page}')
-            self.prb = BeautifulSoup(prb_html, 'lxml')
-            prb_titles += self.prb.find_all('h5', "title")
-            prb_authors += self.prb.find_all('h6', "authors")
-            prb_pubinfo += self.prb.find_all('h6', 'pub-info')
-        prb_links = [prb_titles[i].find('a').attrs['href'] for i in range(len(prb_titles)) if '<h5 class="title">' in str(prb_titles[i])]
-        prb_papers = {}
-        inx = 0
-        for item in prb_titles:
-            if '<h5 class="title">' in str(item):
-                title = item.text
-                authors = prb_authors[inx].text
-                link = 'https://journals.aps.org' + prb_links[inx]
-                pubinfo = prb_pubinfo[inx].text
-                prb_papers[title] = {
-                        'title':title,
-                        'authors':authors,
-                        'link':link,
-                        'pubinfo':pubinfo,
-                        'abstract':''
-                        }
-                inx += 1
-        if start_page == 1:
-            self.prb_papers = prb_papers
-        else:
-            self.prb_papers.update(prb_papers)
-        self.prb_pages_read += num_pages
-        self.prb_papers_label = tk.Label(self.frame, text='\tPhysical Review B\n', font=journals_font, bg=papers_bg)
-        
-        
-    def _get_arXiv_papers(self):
-        print('parsing new arXiv submissions . . .')
-        arx_html = url.urlopen(r'https://arxiv.org/list/cond-mat/new')
-        self.arx = BeautifulSoup(arx_html, 'lxml')
-        arx_titles = self.arx.find_all('div', 'list-title mathjax')
-        arx_authors = self.arx.find_all('div', 'list-authors')
-        arx_links = [item for item in self.arx.find_all('a') if 'href="/abs' in str(item) and 'Abstract' in str(item)]
-        arx_pubinfo = [item.text for item in arx_links]
-        
-        arx_papers = {}
-        inx = 0
-        for inx in range(len(arx_titles)):
-            title = arx_titles[inx].text.split(' ', 1)[1].split('\n')[0]
-            authors_list = arx_authors[inx].text.split('\nAuthors:\n', 1)[1].split(', \n')
-            authors_list[-1] = authors_list[-1].split('\n')[0]
-            authors = ''
-            for i in range(len(authors_list)):
-                if i == 0:
-                    authors += authors_list[i]
-                elif i == len(authors_list)-1 and i != 0:
-                    authors += ', and ' +authors_list[i]
-                else:
-                    authors += ', ' + authors_list[i]
-            pubinfo = arx_pubinfo[inx]
-            link = 'https://arxiv.org/abs/' + pubinfo.split(':')[1]
-            arx_papers[title] = {
-                      'title':title,
-                      'authors':authors, 
-                      'link':link, 
-                      'pubinfo':pubinfo+' \u2013 Recent',
-                      'abstract':''
-                      }
-        self.arx_papers = arx_papers
-        self.arx_papers_label = tk.Label(self.frame, text='\tarXiv\n', font=journals_font, bg=papers_bg)
-        
-        
-    def _get_Nature_papers(self, start_page=1, num_pages=1):
-        print('opening Nature . . .')
-        nat_titles = []
-        nat_authors = []
-        nat_links = []
-        nat_pubinfo = []
-        for page_num in range(start_page, start_page+num_pages):
-            print(f'\tparsing page {page_num} . . .')
-            nat_html = url.urlopen(f'https://www.nature.com/search?article_type=protocols%2Cresearch%2Creviews&subject=condensed-matter-physics&page={page_num}')
-            nat = BeautifulSoup(nat_html, 'lxml')
-            page_articles = [item for item in nat.find_all('a') if r'nature.com/articles' in str(item)]
-            page_titles = [item.text for item in page_articles]
-            page_papers_info = [item.text for item in nat.find_all('li') if 'author' in str(item)]
-            page_links = [item.attrs['href'] for item in page_articles]
-            page_authors = []
-            page_pubinfo = []
-            j = 0
-            for i in range(len(page_papers_info)):
-                if j == len(page_titles):
-                    break
-                if page_titles[j] in page_papers_info[i]:
-                    k = i + 1
-                    authors = ''
-                    while 'Opens in a new window' not in page_papers_info[k]:
-                        authors += page_papers_info[k]
-                        k += 1
-                        if k == len(page_papers_info)-6:
-                            break
-                    page_authors.append(authors)
-                    date = page_papers_info[i].split(' | ')[1].split(page_titles[j])[0]
-                    branch = page_papers_info[i].split(authors)[1].split('Rights\xa0')[0]
-                    page_pubinfo.append(branch + ' \u2013 Published '+ date)
-                    j += 1
-            nat_titles += page_titles
-            nat_authors += page_authors
-            nat_links += page_links
-            nat_pubinfo += page_pubinfo
-
-        nat_papers = {}
-        for i in range(len(nat_titles)):
-            title = nat_titles[i]
-            authors = nat_authors[i]
-            pubinfo = nat_pubinfo[i]
-            link = nat_links[i]
-            nat_papers[title] = {
-                    'title':title,
-                    'authors':authors,
-                    'link':link,
-                    'pubinfo':pubinfo,
-                    'abstract':''
-                    }
-        if start_page == 1:
-            self.nat_papers = nat_papers
+            if all(len(papers) == 0 for papers in self.journals.values()) and self.offline_message is None:
+                self.offline_message = tk.Label(self, text='\n\nNo Internet Connection', bg=papers_bg)
+                self.offline_message.pack()
+            return
+        print('\nDONE')
+        if self.next_pages is None:
+            self._prefetch_next_pages()
+    
+    
+    def _set_failed(self, source, error):
+        # error is None once the journal loads again
+        if error is None:
+            self.failed.pop(source, None)
+            self.retry_buttons[source].pack_forget()
+            self.error_labels[source].pack_forget()
+            if self.offline_message is not None:
+                self.offline_message.destroy()
+                self.offline_message = None
+            return
+        self.failed[source] = error
+        self.error_labels[source].configure(text=f'could not be loaded: {error}')
+        self.retry_buttons[source].pack(side='left', anchor='n', padx=10, pady=5)
+        self.error_labels[source].pack(side='left', anchor='n', pady=10)
+    
+    
+    def _retry(self, source):
+        # an explicit retry skips the circuit breaker's cool-down and has the fetch timeouts as its only limit
+        breakers.reset(source)
+        self.retry_buttons[source].pack_forget()
+        self.error_labels[source].configure(text='loading...')
+        self.syncing.add(source)
+        self.deadlines[source] = None
+        self.parsers[source] = self._sync_parser([source])
+        self._fetch_pages([(source, 1)], self._on_page_synced, None, self.parsers[source])
+    
+    
+    def _prefetch_next_pages(self):
+        # the next page of every journal is fetched while the current one is read,
+        # so Load More Papers usually has nothing left to wait for
+        if not self.prefetching:
+            self.prefetching = True
+            self._fetch_pages([(source, self.pages_read[source]+1) for source in self.journals], self._on_next_pages_fetched)
+    
+    
+    def _on_next_pages_fetched(self, results):
+        self.prefetching = False
+        self.next_pages = results
+        if self.loading_more:
+            self._load_next_pages()
+    
+    
+    def load_more_papers(self):
+        if self.loading_more:
+            return
+        self.loading_more = True
+        if self.next_pages is not None:
+            self._load_next_pages()
         else:
-            self.nat_papers.update(nat_papers)
-        self.nat_pages_read += 1
-        self.nat_papers_label = tk.Label(self.frame, text='\tNature\n', font=journals_font, bg=papers_bg)
-    
-
-    def show_papers(self, papers):
-        if papers == self.prb_papers or papers == self.root.elements[Filters].prb_hits:
-            self.prb_papers_label.grid_forget()
-            self.prb_papers_label.grid(row=self.row, column=1, sticky='w')    
-        if papers == self.nat_papers or papers == self.root.elements[Filters].nat_hits:
-            self.nat_papers_label.grid_forget()
-            self.nat_papers_label.grid(row=self.row, column=1, sticky='w')
-            
-        if papers == self.arx_papers or papers == self.root.elements[Filters].arx_hits:
-            self.arx_papers_label.grid_forget()
-            self.arx_papers_label.grid(row=self.row, column=1, sticky='w') 
-                
-        self.row += 1
-        link_callbacks = {}
-        abstract_callbacks = {}
-        hover_callbacks = {}
-        for paper in papers.keys():
-            title = papers[paper]['title']
-            authors = papers[paper]['authors']
-            link = papers[paper]['link']
-            pubinfo = papers[paper]['pubinfo']
-            def link_callback(event, link=link):
-                webbrowser.open_new(link)
-            link_callbacks[title] = link_callback
-            def abstract_callback(papers=papers, paper=paper):
-                self._get_abstract(papers, paper)
-            abstract_callbacks[title] = abstract_callback
-            self.labels[title+'-box'] = tk.Label(self.frame, bg=papers_bg, width=200)
-            self.labels[title+'-box'].grid(row=self.row, column=1, rowspan=3, columnspan=3, pady=(0, 5), sticky='nsew')
-            self.labels[title] = tk.Label(self.frame, text=title, font=title_font, bg=title_bg, cursor='hand2', wraplength=1200, justify='left')
-            self.labels[title].bind('<Button-1>', link_callbacks[title])
-            self.labels[title].grid(row=self.row, column=1, padx=40, pady=(5, 0), sticky='w')
-            self.row += 1
-            self.labels[title+'-authors'] = tk.Label(self.frame, text=authors, font=authors_font, bg=papers_bg, wraplength=1200, justify='left', state='normal', activebackground='red4')
-            self.labels[title+'-authors'].grid(row=self.row, column=1, padx=100, sticky='w')
-            self.row +=1
-            self.labels[title+'-pubinfo'] = tk.Label(self.frame, text=pubinfo+'\n', font=authors_font, bg=papers_bg, wraplength=1200, justify='left')
-            self.labels[title+'-pubinfo'].grid(row=self.row, column=1, padx=100, sticky='w')
-            self.labels[title+'-get_abstract'] = tk.Button(self.frame, text='Abstract', command=abstract_callbacks[title], bg=button_color, font=authors_font)
-            self.labels[title+'-get_abstract'].grid(row=self.row, column=1, padx=(200, 0), pady=(0, 35), sticky='n')
-            self.row += 1
-            if self.selection == papers[paper]:
-                self.labels[title].config(bg=selection_bg)
-                self.labels[title+'-authors'].config(bg=selection_bg)
-                self.labels[title+'-pubinfo'].config(bg=selection_bg)
-                self.labels[title+'-box'].config(bg=selection_bg, relief='ridge', bd=5)
-            def on_hover(event, papers=papers, paper=paper):
-                self.hovering = papers[paper]
-                if self.hovering != self.selection:
-                    title = papers[paper]['title']
-                    self.labels[title].config(bg=hover_color)
-                    self.labels[title+'-authors'].config(bg=hover_color)
-                    self.labels[title+'-pubinfo'].config(bg=hover_color)
-                    self.labels[title+'-box'].config(bg=hover_color)
-            hover_callbacks[title+'-enter'] = on_hover
-            def on_leave(event, papers=papers, paper=paper):
-                self.hovering = {}
-                if papers[paper] != self.selection:
-                    title= papers[paper]['title']
-                    self.labels[title].config(bg=title_bg)
-                    self.labels[title+'-authors'].config(bg=papers_bg)
-                    self.labels[title+'-pubinfo'].config(bg=papers_bg)
-                    self.labels[title+'-box'].config(bg=papers_bg)
-            hover_callbacks[title+'-leave'] = on_leave
-            self.labels[title].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title+'-authors'].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title+'-pubinfo'].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title+'-box'].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title].bind('<Leave>', hover_callbacks[title+'-leave'])
-            self.labels[title+'-authors'].bind('<Leave>', hover_callbacks[title+'-leave'])
-            self.labels[title+'-pubinfo'].bind('<Leave>', hover_callbacks[title+'-leave'])
-            self.labels[title+'-box'].bind('<Leave>', hover_callbacks[title+'-leave'])
-
+            self._prefetch_next_pages()
+    
+    
+    def _load_next_pages(self):
+        results = self.next_pages
+        self.next_pages = None
+        self.loading_more = False
+        new_papers = self._merge_pages(results)
+        self.root.elements[Filters].add_papers(new_papers)
+        if all(len(papers) == 0 for papers in new_papers.values()) and any(not isinstance(papers, Exception) and len(papers) > 0 for papers in results.values()):
+            # these pages only held papers that were already archived, so read on
+            self.loading_more = True
+        self._prefetch_next_pages()
+    
+    
+    def show_papers(self, source, papers):
+        self.sections[source]['papers'] = list(papers.values())
+    
+    
+    def append_papers(self, source, papers):
+        self.sections[source]['papers'] += papers
+    
+    
+    def show_section(self, source, shown):
+        # a hidden journal keeps its papers, so showing it again only moves the sections below it
+        self.sections[source]['shown'] = shown
+        self._layout()
+    
+    
+    def _has_header(self, section):
+        return section['shown'] and (len(section['papers']) > 0 or section['source'] in self.failed)
+    
+    
+    def _layout(self):
+        top = 0
+        for section in self.sections.values():
+            if not self._has_header(section):
+                continue
+            section['top'] = top
+            top += header_height + row_height*len(section['papers'])
+        self.configure(scrollregion=(0, 0, self.winfo_width(), max(top, self.winfo_height())))
+        self._render_rows()
+    
+    
+    @traced('render rows')
+    def _render_rows(self):
+        view_top = self.canvasy(0)
+        view_bottom = self.canvasy(self.winfo_height())
+        x = self.scrollbar.winfo_width()
+        width = self.winfo_width() - x
+        used = 0
+        for section in self.sections.values():
+            if not self._has_header(section):
+                self.itemconfigure(self.headers[section['source']], state='hidden')
+                continue
+            self.coords(self.headers[section['source']], x, section['top'])
+            self.itemconfigure(self.headers[section['source']], state='normal')
+            body_top = section['top'] + header_height
+            first = max(0, int((view_top - body_top)//row_height))
+            last = min(len(section['papers']), int((view_bottom - body_top)//row_height) + 1)
+            for i in range(first, last):
+                if used == len(self.rows):
+                    row = PaperRow(self)
+                    self.rows.append((self.create_window(0, 0, window=row, anchor='nw'), row))
+                window, row = self.rows[used]
+                paper = section['papers'][i]
+                row.show(paper, width)
+                if paper.id not in self.abstracts_prioritized:
+                    self.abstracts_prioritized.add(paper.id)
+                    self._request_abstract(paper, priority=2)
+                self.coords(window, x, body_top + i*row_height)
+                self.itemconfigure(window, width=width, height=row_height-5, state='normal')
+                used += 1
+        for window, row in self.rows[used:]:
+            self.itemconfigure(window, state='hidden')
+            row.clear()
+        self.scrollbar.tkraise()
+    
+    
+    def _paint_rows(self):
+        for window, row in self.rows:
+            row.paint()
+    
+    
+    def _on_row_enter(self, row):
+        self.hovering = row.paper
+        row.paint()
+        if self.hover_prefetch is not None:
+            self.after_cancel(self.hover_prefetch)
+        self.hover_prefetch = self.after(hover_prefetch_delay, self._request_abstract, row.paper, 1)
+    
+    
+    def _on_row_leave(self, row):
+        self.hovering = None
+        row.paint()
+        if self.hover_prefetch is not None:
+            self.after_cancel(self.hover_prefetch)
+            self.hover_prefetch = None
     
 
     def _select_paper(self, event):
-        if self.hovering != {} and self.hovering != self.selection:
-            if self.selection != {}:
-                try:
-                    past_sel = self.selection['title']
-                    self.labels[past_sel].config(bg=title_bg)
-                    self.labels[past_sel+'-authors'].config(bg=papers_bg)
-                    self.labels[past_sel+'-pubinfo'].config(bg=papers_bg)
-                    self.labels[past_sel+'-box'].config(bg=papers_bg, relief='flat', bd=0)
-                except:
-                    None
+        filters = self.root.elements[Filters]
+        if self.hovering is not None and self.hovering is not self.selection:
             self.selection = self.hovering
-            title = self.selection['title']
-            self.labels[title].config(bg=selection_bg)
-            self.labels[title+'-authors'].config(bg=selection_bg)
-            self.labels[title+'-pubinfo'].config(bg=selection_bg)
-            self.labels[title+'-box'].config(bg=selection_bg, relief='ridge', bd=5)
-            self.root.elements[Filters].selected_paper_title.set(self.selection['title'])
-            self.root.elements[Filters].selected_paper_authors.set(self.selection['authors'])
-            self.root.elements[Filters].selected_paper_pubinfo.set(self.selection['pubinfo'])
-            self.root.elements[Filters].save_button.grid(row=self.root.elements[Filters].row, column=0,columnspan=3, padx=(85, 0), pady=(0, 100), sticky='w')
+            filters.selected_paper_title.set(self.selection.title)
+            filters.selected_paper_authors.set(self.selection.authors)
+            filters.selected_paper_pubinfo.set(self.selection.pubinfo)
+            filters.save_button.grid(row=filters.row, column=0,columnspan=3, padx=(85, 0), pady=(0, 100), sticky='w')
             
-        elif self.hovering != {} and self.hovering == self.selection:
-            title = self.selection['title']
-            self.labels[title].config(bg=title_bg)
-            self.labels[title+'-authors'].config(bg=hover_color)
-            self.labels[title+'-pubinfo'].config(bg=hover_color)
-            self.labels[title+'-box'].config(bg=hover_color, relief='flat', bd=0)
-            self.selection = {}
-            self.root.elements[Filters].save_button.grid_forget()
-            self.root.elements[Filters].selected_paper_title.set('')
-            self.root.elements[Filters].selected_paper_authors.set('')
-            self.root.elements[Filters].selected_paper_pubinfo.set('')
+        elif self.hovering is not None and self.hovering is self.selection:
+            self.selection = None
+            filters.save_button.grid_forget()
+            filters.selected_paper_title.set('')
+            filters.selected_paper_authors.set('')
+            filters.selected_paper_pubinfo.set('')
+        self._paint_rows()
             
         
     
-    def _get_abstract(self, journal, paper):
-        self.update_idletasks()
-        if journal[paper]['abstract'] == '':
-            link = journal[paper]['link']
-            paper_page_html = url.urlopen(link)
-            paper_page = BeautifulSoup(paper_page_html, 'lxml')
-            
-            if journal == self.prb_papers or journal == self.root.elements[Filters].prb_hits:
-                abstract = paper_page.find_all('p')[0].text
-            if journal == self.nat_papers or journal == self.root.elements[Filters].nat_hits:
-                abstract = paper_page.find_all('p')[4].text
-            if journal == self.arx_papers or journal == self.root.elements[Filters].arx_hits:
-                abstract = paper_page.find_all('blockquote')[0].text.split('Abstract: ')[1]
-            journal[paper]['abstract'] = abstract
+    def _request_abstract(self, paper, priority):
+        # priority 0 is a click on Abstract, 1 a paper the pointer rests on, 2 a paper in view and 3 everything else
+        if paper.abstract == '':
+            self.abstract_requests.put((priority, next(self.abstract_order), paper))
+    
+    
+    def _abstract_worker(self):
+        # runs on a background thread, so it must not touch any widgets
+        while True:
+            priority, order, paper = self.abstract_requests.get()
+            with self.abstract_lock:
+                if paper.id in self.abstracts_claimed:
+                    continue
+                self.abstracts_claimed.add(paper.id)
+            try:
+                with span('abstract', source=paper.source, priority=priority):
+                    abstract = get_abstract(paper, self.cache, self.limiter)
+                self.archive.set_abstract(paper.id, abstract)
+            except Exception as error:
+                print(f'ERROR: Could not get the abstract of {paper.link}: {error}')
+                abstract = None
+                with self.abstract_lock:
+                    self.abstracts_claimed.discard(paper.id)
+            self.fetched.put((self._on_abstract_fetched, (paper, abstract)))
+    
+    
+    def _on_abstract_fetched(self, paper, abstract):
+        wanted = self.abstract_wanted is paper
+        if wanted:
+            self.abstract_wanted = None
+        if abstract is None:
+            return
+        paper.abstract = abstract
+        self.index.update(paper, 'abstract')
+        self.abstracts.add(paper)
+        if wanted:
+            self._show_abstract(paper)
+    
+    
+    def _get_abstract(self, paper):
+        if self.abstracts.text(paper) != '':
+            self._show_abstract(paper)
         else:
-            abstract = journal[paper]['abstract']
-        
-        abstract_window = tk.Tk()
-        abstract_window.title('')
-        aw_frame = tk.Frame(abstract_window, bg=abstract_bg)
-        aw_frame.pack(side='top', fill='both', expand=True)
-        
-        title_label = tk.Label(aw_frame, text=paper, font=title_font, bg=abstract_bg, wraplength=900, justify='left')
-        title_label.grid(row=0, column=0, padx=40, sticky='w')
-        authors_label = tk.Label(aw_frame, text=journal[paper]['authors'], font=authors_font, bg=abstract_bg, wraplength=800, justify='left')
-        authors_label.grid(row=1, column=0, padx=40, sticky='w')
-        text = tk.Label(aw_frame, text=abstract, wraplength=800, bg=abstract_bg, justify='left')
-        text.grid(row=2, column=0, sticky='w', padx=65, pady=40)
+            # shown by _on_abstract_fetched once it arrives
+            self.abstract_wanted = paper
+            self._request_abstract(paper, priority=0)
+    
+    
+    def _field_texts(self, papers, field):
+        if field == 'abstract':
+            return self.abstracts.texts(papers)
+        return SearchIndex._texts(papers, field)
+    
+    
+    @traced('show abstract')
+    def _show_abstract(self, paper):
+        if self.abstract_viewer is None:
+            self.abstract_viewer = AbstractViewer(self.root)
+        self.abstract_viewer.show(paper)
         
         
 
     def _on_configure(self, event):
-        frame_height = self.frame.winfo_height()
-        self.configure(height=frame_height)
-        self.configure(scrollregion=self.bbox('all'))
-        self.update_idletasks()
-        frame_height = self.frame.winfo_height()
-        self.configure(height=frame_height)
-        self.configure(scrollregion=self.bbox('all'))
+        self._layout()
+    
+    
+    def _yview(self, *args):
+        self.yview(*args)
+        self._render_rows()
     
     
     def _scroll_papers(self, event):
@@ -406,35 +565,163 @@ class Papers(tk.Canvas):
     def _on_mouse_wheel(self, event):
         if self.root.scroller == 'papers':
             self.yview_scroll(int(-1*(event.delta/120)), 'units')
+            self._render_rows()
         if self.root.scroller == 'db_handler':
-            self.root.elements[Filters].db_handler.yview_scroll(int(-1*(event.delta/120)), 'units')
+            self.root.elements[Filters].db_handler._yview('scroll', int(-1*(event.delta/120)), 'units')
 
         
 
         
 
+class PaperRow(tk.Frame):
+    def __init__(self, papers_canvas):
+        tk.Frame.__init__(self, papers_canvas, bg=papers_bg)
+        self.canvas = papers_canvas
+        self.paper = None
+        self.title = tk.Label(self, font=title_font, bg=title_bg, cursor='hand2', wraplength=1200, justify='left')
+        self.title.grid(row=0, column=0, columnspan=2, padx=40, pady=(5, 0), sticky='w')
+        self.authors = tk.Label(self, font=authors_font, bg=papers_bg, wraplength=1200, justify='left')
+        self.authors.grid(row=1, column=0, columnspan=2, padx=100, sticky='w')
+        self.pubinfo = tk.Label(self, font=authors_font, bg=papers_bg, wraplength=1200, justify='left')
+        self.pubinfo.grid(row=2, column=0, padx=(100, 0), sticky='w')
+        self.abstract_button = tk.Button(self, text='Abstract', command=self._get_abstract, bg=button_color, font=authors_font)
+        self.abstract_button.grid(row=2, column=1, padx=20, sticky='w')
+        self.versions = tk.Label(self, font=authors_font, bg=papers_bg, cursor='hand2')
+        self.versions.grid(row=2, column=2, sticky='w')
+        self.title.bind('<Button-1>', self._open_link)
+        self.versions.bind('<Button-1>', self._open_versions)
+        for widget in (self, self.title, self.authors, self.pubinfo, self.versions):
+            widget.bind('<Enter>', self._on_hover)
+            widget.bind('<Leave>', self._on_leave)
+    
+    
+    def show(self, paper, width):
+        if paper is not self.paper:
+            self.paper = paper
+            authors = paper.authors
+            if len(authors) > max_authors_length:
+                authors = authors[:max_authors_length] + ' . . .'
+            self.title.config(text=paper.title, wraplength=width-80)
+            self.authors.config(text=authors, wraplength=width-140)
+            self.pubinfo.config(text=paper.pubinfo)
+        # other versions can be merged in after the row is first shown
+        if len(paper.versions) > 0:
+            self.versions.config(text='Also in ' + ', '.join(journal_names.get(version.source, version.source) for version in paper.versions))
+            self.versions.grid()
+        else:
+            self.versions.grid_remove()
+        self.paint()
+    
+    
+    def clear(self):
+        self.paper = None
+    
+    
+    def paint(self):
+        if self.paper is None:
+            return
+        if self.paper is self.canvas.selection:
+            bg = selection_bg
+            title_color = selection_bg
+            self.config(relief='ridge', bd=5)
+        else:
+            bg = hover_color if self.paper is self.canvas.hovering else papers_bg
+            title_color = hover_color if self.paper is self.canvas.hovering else title_bg
+            self.config(relief='flat', bd=0)
+        self.config(bg=bg)
+        self.title.config(bg=title_color)
+        self.authors.config(bg=bg)
+        self.pubinfo.config(bg=bg)
+        self.versions.config(bg=bg)
+    
+    
+    def _open_link(self, event):
+        webbrowser.open_new(self.paper.link)
+    
+    
+    def _open_versions(self, event):
+        for version in self.paper.versions:
+            webbrowser.open_new(version.link)
+    
+    
+    def _get_abstract(self):
+        self.canvas._get_abstract(self.paper)
+    
+    
+    def _on_hover(self, event):
+        if self.paper is not None:
+            self.canvas._on_row_enter(self)
+    
+    
+    def _on_leave(self, event):
+        if self.paper is not None:
+            self.canvas._on_row_leave(self)
+        
+    
+
+class AbstractViewer(tk.Toplevel):
+    """
+    The window that abstracts are read in. There is only one: closing it hides
+    it, and the next abstract is written into the same labels.
+    """
+    def __init__(self, root):
+        tk.Toplevel.__init__(self, root)
+        self.title('')
+        self.protocol('WM_DELETE_WINDOW', self.withdraw)
+        aw_frame = tk.Frame(self, bg=abstract_bg)
+        aw_frame.pack(side='top', fill='both', expand=True)
+        
+        self.title_label = tk.Label(aw_frame, font=title_font, bg=abstract_bg, wraplength=900, justify='left')
+        self.title_label.grid(row=0, column=0, padx=40, sticky='w')
+        self.authors_label = tk.Label(aw_frame, font=authors_font, bg=abstract_bg, wraplength=800, justify='left')
+        self.authors_label.grid(row=1, column=0, padx=40, sticky='w')
+        self.text = tk.Label(aw_frame, wraplength=800, bg=abstract_bg, justify='left')
+        self.text.grid(row=2, column=0, sticky='w', padx=65, pady=40)
+    
+    
+    def show(self, paper):
+        self.title_label.config(text=paper.title)
+        self.authors_label.config(text=paper.authors)
+        self.text.config(text=paper.abstract)
+        self.deiconify()
+        self.lift()
+        
+    
+
 class Filters(tk.Frame):
     def __init__(self, root):
         tk.Frame.__init__(self, root, bg=filters_bg)
         self.root = root
         self._searched = False
+        self._pending_search = None
+        self.last_search = None
+        self.ranker = None
+        self.library_scores = {}
+        self.followed = {}
         root.bind('<Return>', self._search)
-        self.prb_hits = {}
-        self.nat_hits = {}
-        self.arx_hits = {}
+        self.hits = {source:{} for source in journal_names}
+        self.toggles = {}
         
         row = 0
         self.search_str = tk.StringVar()
+        self.search_str.trace_add('write', self._on_query_typed)
         search_box = tk.Entry(self, textvariable=self.search_str, width=45)
         search_box.grid(row=row, column=0, padx=3, pady=20, sticky='w')
         search_button = tk.Button(self, text='Search', command=self._search)
         search_button.grid(row=row, column=1, columnspan=3, sticky='w')
+        # by:name limits the list to one author; while it is typed, the matching names drop down below the box
+        self.suggestions = tk.Listbox(self, height=author_suggestions, font=filters_list_font, activestyle='none')
+        self.suggestions.bind('<ButtonRelease-1>', self._complete_author)
+        self.search_box = search_box
         
         row += 1
         self.num_results = tk.StringVar()
         self._count_results()
         results_label = tk.Label(self, textvariable=self.num_results, bg=filters_bg)
         results_label.grid(row=row, column=0)
+        self.sort_by_library = tk.IntVar(root, value=0)
+        sort_button = tk.Checkbutton(self, text='Sort by My Library', variable=self.sort_by_library, command=self.refresh, font=filters_list_font, bg=filters_bg)
+        sort_button.grid(row=row, column=1, columnspan=3, sticky='w')
         
         row += 1
         format_line = tk.Label(self, text='_'*115, bg=filters_bg)
@@ -444,34 +731,37 @@ class Filters(tk.Frame):
         journal_filter_label = tk.Label(self, text='Journals', bg=filters_bg, font=filters_font)
         journal_filter_label.grid(row=row, column=0, padx=10, pady=15, sticky='e')
         
-        row += 1
-        self.prb_toggle = tk.IntVar(root, value=1)
-        prb_toggle_button = tk.Checkbutton(self, text='Physical Review B', variable=self.prb_toggle, font=filters_list_font, bg=filters_bg)
-        prb_toggle_button.grid(row=row, column=0, padx=(100, 0), sticky='w')
-        
-        new_journal_toggle_button = tk.Checkbutton(self, text='Another Journal', font=filters_list_font, bg=filters_bg)
-        new_journal_toggle_button.grid(row=row, column=1, padx=(10, 250), sticky='w')
-        
-        row += 1
-        self.nat_toggle = tk.IntVar(root, value=1)
-        nat_toggle_button = tk.Checkbutton(self, text='Nature', variable=self.nat_toggle, font=filters_list_font, bg=filters_bg)
-        nat_toggle_button.grid(row=row, column=0, padx=(100, 0), sticky='w')
-
-        new_journal_toggle_button = tk.Checkbutton(self, text='Another Journal', font=filters_list_font, bg=filters_bg)
-        new_journal_toggle_button.grid(row=row, column=1, padx=(10, 250), sticky='w')
-        
-        row += 1
-        self.arx_toggle = tk.IntVar(root, value=1)
-        arx_toggle_button = tk.Checkbutton(self, text='arXiv', variable=self.arx_toggle, font=filters_list_font, bg=filters_bg)
-        arx_toggle_button.grid(row=row, column=0, padx=(100, 0), sticky='w')
-
-        new_journal_toggle_button = tk.Checkbutton(self, text='Another Journal', font=filters_list_font, bg=filters_bg)
-        new_journal_toggle_button.grid(row=row, column=1, padx=(10, 250), sticky='w')
+        # the journals fill the left column and then the right one; any slots left over
+        # keep an 'Another Journal' placeholder
+        toggle_rows = max(3, math.ceil(len(journal_names)/2))
+        toggle_sources = list(journal_names) + [None]*(2*toggle_rows - len(journal_names))
+        for i, source in enumerate(toggle_sources):
+            column = i // toggle_rows
+            padx = (100, 0) if column == 0 else (10, 250)
+            if source is None:
+                toggle_button = tk.Checkbutton(self, text='Another Journal', font=filters_list_font, bg=filters_bg)
+            else:
+                self.toggles[source] = tk.IntVar(root, value=1)
+                toggle_button = tk.Checkbutton(self, text=journal_names[source], variable=self.toggles[source], font=filters_list_font, bg=filters_bg,
+                                               command=lambda source=source: self._toggle(source))
+            toggle_button.grid(row=row+1 + i % toggle_rows, column=column, padx=padx, sticky='w')
+        row += toggle_rows
 
         row += 1
         format_line = tk.Label(self, text='_'*115, bg=filters_bg)
         format_line.grid(row=row, column=0, columnspan=3, sticky='w')
         
+        row += 1
+        self.follow_button = tk.Button(self, text='Follow by: author', command=self._follow, state='disabled')
+        self.follow_button.grid(row=row, column=0, padx=(85, 0), pady=(10, 0), sticky='w')
+        self.followed_only = tk.IntVar(root, value=0)
+        followed_only_button = tk.Checkbutton(self, text='Followed authors only', variable=self.followed_only, command=self.refresh, font=filters_list_font, bg=filters_bg)
+        followed_only_button.grid(row=row, column=1, columnspan=3, pady=(10, 0), sticky='w')
+        row += 1
+        self.following = tk.StringVar(root, '')
+        following_label = tk.Label(self, textvariable=self.following, font=authors_font, bg=filters_bg, wraplength=800, justify='left')
+        following_label.grid(row=row, column=0, columnspan=3, padx=(85, 0), sticky='w')
+        
         row += 1
         more_papers_button = tk.Button(self, text='Load More Papers', command=self.get_more_papers)
         more_papers_button.grid(row=row, column=0, padx=85, sticky='w')
@@ -494,98 +784,258 @@ class Filters(tk.Frame):
         row += 1
         saved_papers_label = tk.Label(self, text='My Library', font=filters_font, bg=filters_bg)
         saved_papers_label.place(relx=0.0, rely=0.62)
+        import_button = tk.Button(self, text='Import', command=self._import_library, font=authors_font, bg=button_color)
+        import_button.place(relx=0.15, rely=0.62)
+        export_button = tk.Button(self, text='Export', command=self._export_library, font=authors_font, bg=button_color)
+        export_button.place(relx=0.22, rely=0.62)
         
         self.db_handler = Database_Handler(self, self.root)
         self.db_handler.place(relx=0.0, rely=0.65, relwidth=1.0, relheight=0.34)
+        self.followed = self.db_handler.library.followed_authors()
+        self._show_followed()
         
         
         
     def _search(self, event=1):
+        if self._pending_search is not None:
+            self.after_cancel(self._pending_search)
+            self._pending_search = None
         self._searched = True
-        search_str = self.search_str.get().lower()
-
-        self.prb_hits = {}
-        for key in self.root.elements[Papers].prb_papers.keys():
-            paper = self.root.elements[Papers].prb_papers[key]
-            if search_str in paper['title'].lower() or search_str in paper['abstract']:
-                self.prb_hits[paper['title']] = paper
-        
-        self.nat_hits = {}
-        for key in self.root.elements[Papers].nat_papers.keys():
-            paper = self.root.elements[Papers].nat_papers[key]
-            if search_str in paper['title'].lower() or search_str in paper['abstract']:
-                self.nat_hits[paper['title']] = paper
-    
-        self.arx_hits = {}
-        for key in self.root.elements[Papers].arx_papers.keys():
-            paper = self.root.elements[Papers].arx_papers[key]
-            if search_str in paper['title'].lower() or search_str in paper['abstract']:
-                self.arx_hits[paper['title']] = paper   
-        
-        for key in self.root.elements[Papers].labels.keys():
-            self.root.elements[Papers].labels[key].destroy()
-
-        self.root.elements[Papers].row = 0
-        if len(self.prb_hits) > 0 and self.prb_toggle.get() == 1:
-            self.root.elements[Papers].show_papers(self.prb_hits)
+        self.refresh()
+    
+    
+    def _on_query_typed(self, *args):
+        # filters as you type once the typing pauses; a query too short to narrow much waits for Return,
+        # but clearing the box shows everything again
+        if self._pending_search is not None:
+            self.after_cancel(self._pending_search)
+            self._pending_search = None
+        self._suggest_authors()
+        self._update_follow_button()
+        query = self.search_str.get().strip()
+        if 0 < len(query) < live_search_min_length:
+            return
+        self._pending_search = self.after(search_delay, self._search)
+    
+    
+    def _typed_author(self):
+        # the by: term the cursor is at the end of, if it is still being typed
+        query = self.search_str.get()
+        for match in author_term_pattern.finditer(query):
+            if match.end() == len(query) and match.group(2) != '"':
+                return match
+        return None
+    
+    
+    def _suggest_authors(self):
+        match = self._typed_author()
+        names = []
+        if match is not None:
+            names = self.root.elements[Papers].author_index.complete(match.group(1) or match.group(3) or '')
+        self.suggestions.delete(0, 'end')
+        if len(names) == 0:
+            self.suggestions.place_forget()
+            return
+        self.suggestions.insert('end', *names)
+        self.suggestions.configure(height=len(names))
+        self.suggestions.place(in_=self.search_box, relx=0, rely=1, relwidth=1)
+        self.suggestions.lift()
+    
+    
+    def _complete_author(self, event):
+        match = self._typed_author()
+        selected = self.suggestions.curselection()
+        if match is not None and len(selected) > 0:
+            query = self.search_str.get()
+            self.search_str.set(query[:match.start()] + f'by:"{self.suggestions.get(selected[0])}" ')
+            self.search_box.icursor('end')
+        self.suggestions.place_forget()
+    
+    
+    def _query_authors(self):
+        return [quoted or word for quoted, closing, word in author_term_pattern.findall(self.search_str.get()) if quoted or word]
+    
+    
+    def _update_follow_button(self):
+        # follows or unfollows the authors named with by: in the search box
+        names = self._query_authors()
+        if len(names) == 0:
+            self.follow_button.config(text='Follow by: author', state='disabled')
+        elif all(author_key(name) in self.followed for name in names):
+            self.follow_button.config(text='Unfollow ' + ', '.join(names), state='normal')
         else:
-            self.root.elements[Papers].prb_papers_label.grid_forget()
-        if len(self.nat_hits) > 0 and self.nat_toggle.get() == 1:
-            self.root.elements[Papers].show_papers(self.nat_hits)
+            self.follow_button.config(text='Follow ' + ', '.join(names), state='normal')
+    
+    
+    def _follow(self):
+        names = self._query_authors()
+        library = self.db_handler.library
+        if all(author_key(name) in self.followed for name in names):
+            for name in names:
+                library.unfollow(name)
         else:
-            self.root.elements[Papers].nat_papers_label.grid_forget()
-        if len(self.arx_hits) > 0 and self.arx_toggle.get() == 1:
-            self.root.elements[Papers].show_papers(self.arx_hits)
+            for name in names:
+                library.follow(name)
+        self.followed = library.followed_authors()
+        self._show_followed()
+        self._update_follow_button()
+        if self.followed_only.get() == 1:
+            self.refresh()
+    
+    
+    def _show_followed(self):
+        if len(self.followed) == 0:
+            self.following.set('Not following any authors')
         else:
-            self.root.elements[Papers].arx_papers_label.grid_forget()
+            self.following.set('Following ' + ', '.join(self.followed.values()))
+    
+    
+    def _by_authors(self, ranked):
+        # keeps the papers by every by: author in the query and, if asked, by a followed author
+        author_index = self.root.elements[Papers].author_index
+        for name in self._query_authors():
+            papers = author_index.papers_by(name)
+            ranked = [paper_id for paper_id in ranked if paper_id in papers]
+        if self.followed_only.get() == 1:
+            papers = set()
+            for name in self.followed.values():
+                papers |= author_index.papers_by(name)
+            ranked = [paper_id for paper_id in ranked if paper_id in papers]
+        return ranked
+    
+    
+    def _narrows(self, query, version):
+        # the hits of the last search are searched again when the query narrows it and no paper has been indexed since
+        if self.last_search is None:
+            return None
+        last_query, last_version, last_hits = self.last_search
+        if last_hits is None or version != last_version or not narrows(last_query, query):
+            return None
+        return last_hits
+    
+    
+    def refresh(self):
+        # reruns the current search over every loaded paper and redraws the list
+        p = self.root.elements[Papers]
+        query = self.search_str.get()
+        within = self._narrows(query, p.index.version)
+        with span('search', query=query, narrowed=within is not None):
+            ranked = p.index.search(author_term_pattern.sub(' ', query), within=within)
+        self.last_search = (query, p.index.version, None if ranked is None else set(ranked))
+        if ranked is None:
+            ranked = [paper_id for source in p.journals for paper_id in p.journals[source]]
+        ranked = self._by_authors(ranked)
+        if self.sort_by_library.get() == 1:
+            ranked = self._by_library(ranked)
 
-        self.root.elements[Papers]._on_configure(1)
+        self.hits = {source:{} for source in p.journals}
+        for paper_id in ranked:
+            paper = p.index.docs[paper_id]
+            self.hits[paper.source][paper_id] = paper
+        
+        # every journal gets its hits, shown or not, so that a toggle never has to search again
+        for source, hits in self.hits.items():
+            p.show_papers(source, hits)
+
+        p._layout()
+        self._count_results()
+    
+    
+    def _by_library(self, ranked):
+        # scores are kept until the library changes; a paper scored before its abstract
+        # arrived is scored again once it has one
+        p = self.root.elements[Papers]
+        if self.ranker is None:
+            with span('library ranker', saved=len(self.db_handler.saved_papers)):
+                self.ranker = LibraryRanker(self.db_handler.saved_papers.values())
+        unscored = [p.index.docs[paper_id] for paper_id in ranked
+                    if self.library_scores.get(paper_id, (None,))[0] != (p.index.docs[paper_id].abstract != '')]
+        if len(unscored) > 0:
+            with span('library scores', papers=len(unscored)):
+                for paper_id, score in self.ranker.scores(unscored, p.index).items():
+                    self.library_scores[paper_id] = (p.index.docs[paper_id].abstract != '', score)
+        return sorted(ranked, key=lambda paper_id: self.library_scores[paper_id][1], reverse=True)
+    
+    
+    def library_changed(self):
+        self.ranker = None
+        self.library_scores = {}
+        if self.sort_by_library.get() == 1:
+            self.refresh()
+    
+    
+    def _toggle(self, source):
+        self.root.elements[Papers].show_section(source, self.toggles[source].get() == 1)
         self._count_results()
     
     
     def _count_results(self):
         if self._searched:
-            num = len(self.prb_hits)*self.prb_toggle.get() + len(self.nat_hits)*self.nat_toggle.get() + len(self.arx_hits)*self.arx_toggle.get()
+            num = sum(len(hits)*self.toggles[source].get() for source, hits in self.hits.items())
         else:
             num = 'Search to filter'
         self.num_results.set(f'{num} results')
         
         
     def get_more_papers(self):
+        self.root.elements[Papers].load_more_papers()
+    
+    
+    def add_papers(self, new_papers):
+        # appends newly loaded papers that match the current search, leaving the rows already listed alone
         p = self.root.elements[Papers]
-        p.prb_papers_label.grid_forget()
-        p.nat_papers_label.grid_forget()
-        p.arx_papers_label.grid_forget()
-        p._get_PhysRevB_papers(start_page=p.prb_pages_read+1)
-        p._get_Nature_papers(start_page=p.nat_pages_read+1)
-        self._search()
+        if self.sort_by_library.get() == 1:
+            # the new papers may belong anywhere in the order
+            self.refresh()
+            return
+        new_ids = {paper.id for papers in new_papers.values() for paper in papers}
+        ranked = p.index.search(author_term_pattern.sub(' ', self.search_str.get()), within=new_ids)
+        if ranked is None:
+            ranked = [paper.id for papers in new_papers.values() for paper in papers]
+        ranked = self._by_authors(ranked)
+        added = {source:[] for source in self.hits}
+        for paper_id in ranked:
+            paper = p.index.docs[paper_id]
+            self.hits[paper.source][paper_id] = paper
+            added[paper.source].append(paper)
+        for source in added:
+            p.append_papers(source, added[source])
+        p._layout()
+        self._count_results()
 
         
     
+    def _import_library(self):
+        path = filedialog.askopenfilename(title='Import papers into My Library', filetypes=library_file_types)
+        if path:
+            try:
+                added = self.db_handler.library.import_file(path)
+            except (OSError, ValueError, sqlite3.Error) as error:
+                print(f'ERROR: Could not import {path}: {error}')
+                return
+            print(f'{added} papers imported from {path}')
+            self.db_handler.load_new_papers()
+            self.library_changed()
+    
+    
+    def _export_library(self):
+        path = filedialog.asksaveasfilename(title='Export My Library', filetypes=library_file_types, defaultextension='.bib')
+        if path:
+            try:
+                self.db_handler.library.export_file(path)
+            except (OSError, ValueError) as error:
+                print(f'ERROR: Could not export to {path}: {error}')
+    
+    
     def _save(self):
-        with open(database_path, 'a', newline='') as db:
-            w = csv.writer(db, dialect='excel')
-            paper = self.root.elements[Papers].selection
-            row = []
-            for key in paper.keys():
-                row.append(paper[key].encode('utf-8'))
-            w.writerow(row)
-            db.close()
-        
-        self.db_handler.saved_papers[row[0]] = {
-                'title':row[0],
-                'authors':row[1],
-                'link':row[2],
-                'pubinfo':row[3],
-                'abstract':row[4]
-                }
-        
-        for key in self.db_handler.labels.keys():
-            self.db_handler.labels[key].destroy()
-        self.db_handler.labels = {}
-        self.db_handler.load_saved_papers()
-        self.db_handler.show_saved_papers(self.db_handler.saved_papers)
-        self.db_handler._on_configure(1)
+        paper = self.root.elements[Papers].selection
+        self.root.elements[Papers].abstracts.text(paper)
+        if self.db_handler.library.save(paper):
+            paper = Paper('library', paper.link, paper.title, paper.authors, paper.link, paper.pubinfo, paper.abstract)
+            self.db_handler.saved_papers[paper.title] = paper
+            self.db_handler.show_saved_papers({paper.title:paper})
+            self.root.elements[Papers].author_index.add(paper)
+            self.library_changed()
             
     
     
@@ -596,126 +1046,169 @@ class Database_Handler(tk.Canvas):
     def __init__(self, parent, root):
         tk.Canvas.__init__(self, parent, bg=papers_bg, relief='ridge', bd=5)
         self.root = root
-        self.row = 0
-        self.labels = {}
-        self.selection = {}
-        self.hovering = {}
-        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.selection = None
+        self.hovering = None
+        self.scrollbar = tk.Scrollbar(self, command=self._yview)
         self.scrollbar.pack(side='left', fill='y')
         self.configure(yscrollcommand = self.scrollbar.set)
         self.bind('<Configure>', self._on_configure)
-        self.frame = tk.Frame(self, bg=papers_bg)
-        self.create_window((0,0), window=self.frame, anchor='nw')
         self.bind('<Enter>', self._scroll_db_handler)
         
+        # the library is listed the way the papers are: only the rows in view get widgets
+        self.rows = []
+        self.library = Library(database_path)
+        self.library.import_csv(csv_database_path)
         self.load_saved_papers()
-        self.show_saved_papers(self.saved_papers)
-        self.scrollbar.tkraise()
         
         
     def load_saved_papers(self):
         self.saved_papers = {}
-        with open(database_path, 'r') as db:
-            rows = csv.reader(db, dialect='excel')
-            for row in rows:
-                row = [cell.split("b'", 1)[1][:len(cell.split("b'",1)[1])-1] for cell in row]
-                self.saved_papers[row[0]] = {
-                        'title':row[0],
-                        'authors':row[1],
-                        'link':row[2],
-                        'pubinfo':row[3],
-                        'abstract':row[4]
-                        }
+        for paper in self.library.papers():
+            self.saved_papers[paper.title] = paper
+        self.listed = list(self.saved_papers.values())
+    
+    
+    def load_new_papers(self):
+        # shows the papers that were added to the library by an import
+        new_papers = {paper.title:paper for paper in self.library.papers() if paper.title not in self.saved_papers}
+        self.saved_papers.update(new_papers)
+        self.show_saved_papers(new_papers)
+        for paper in new_papers.values():
+            self.root.elements[Papers].author_index.add(paper)
+    
     
     def show_saved_papers(self, papers):
-        self.row += 1
-        link_callbacks = {}
-        hover_callbacks = {}
-        remove_callbacks = {}
-        for paper in papers.keys():
-            title = papers[paper]['title']
-            authors = papers[paper]['authors']
-            link = papers[paper]['link']
-            def link_callback(event, link=link):
-                webbrowser.open_new(link)
-            link_callbacks[title] = link_callback
-            self.labels[title+'-box'] = tk.Label(self.frame, bg=papers_bg, width=200)
-            self.labels[title+'-box'].grid(row=self.row, column=1, rowspan=3, columnspan=3, pady=(0, 5), sticky='nsew')
-            self.labels[title] = tk.Label(self.frame, text=title, font=title_font, bg=title_bg, cursor='hand2', wraplength=850, justify='left')
-            self.labels[title].bind('<Button-1>', link_callbacks[title])
-            self.labels[title].grid(row=self.row, column=1, padx=40, pady=(5, 0), sticky='w')
-            self.row += 1
-            self.labels[title+'-authors'] = tk.Label(self.frame, text=authors, font=authors_font, bg=papers_bg, wraplength=800, justify='left', state='normal', activebackground='red4')
-            self.labels[title+'-authors'].grid(row=self.row, column=1, padx=100, sticky='w')
-            def remove_paper(papers=papers, paper=paper):
-                title = papers[paper]['title']
-                self.labels[title+'-box'].destroy()
-                self.labels[title].destroy()
-                self.labels[title+'-authors'].destroy()
-                self.labels[title+'-remove'].destroy()
-                self.saved_papers = {k:self.saved_papers[k] for k in self.saved_papers.keys() if k != title}
-                self._remove_from_database(papers[paper])
-                print('working')
-            remove_callbacks[title] = remove_paper
-            self.labels[title+'-remove'] = tk.Button(self.frame, text='Remove', font=authors_font, bg=button_color, command=remove_callbacks[title])
-            self.labels[title+'-remove'].grid(row=self.row-1, column=1, padx=900, sticky='w')
-            self.row += 1
-            def on_hover(event, papers=papers, paper=paper):
-                self.hovering = papers[paper]
-                title = papers[paper]['title']
-                self.labels[title].config(bg=hover_color)
-                self.labels[title+'-authors'].config(bg=hover_color)
-                self.labels[title+'-box'].config(bg=hover_color)
-            hover_callbacks[title+'-enter'] = on_hover
-            def on_leave(event, papers=papers, paper=paper):
-                self.hovering = {}
-                title= papers[paper]['title']
-                self.labels[title].config(bg=title_bg)
-                self.labels[title+'-authors'].config(bg=papers_bg)
-                self.labels[title+'-box'].config(bg=papers_bg)
-            hover_callbacks[title+'-leave'] = on_leave
-            self.labels[title].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title+'-authors'].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title+'-box'].bind('<Enter>', hover_callbacks[title+'-enter'])
-            self.labels[title].bind('<Leave>', hover_callbacks[title+'-leave'])
-            self.labels[title+'-authors'].bind('<Leave>', hover_callbacks[title+'-leave'])
-            self.labels[title+'-box'].bind('<Leave>', hover_callbacks[title+'-leave'])
-    
-    
-    def _remove_from_database(self, paper):
-        with open(database_path, 'w+', newline='') as db:
-            w = csv.writer(db, dialect='excel')
-            for key in self.saved_papers.keys():
-                pap = self.saved_papers[key]
-                if pap == paper:
-                    pass
-                else:
-                    row = []
-                    for key in paper.keys():
-                        row.append(pap[key].encode('utf-8'))
-                    w.writerow(row)
-        
-        
-
-    def _on_configure(self, event):
-        frame_height = self.frame.winfo_height()
-        self.configure(height=frame_height)
-        self.configure(scrollregion=self.bbox('all'))
-        self.update_idletasks()
-        frame_height = self.frame.winfo_height()
-        self.configure(height=frame_height)
-        self.configure(scrollregion=self.bbox('all'))
+        self.listed.extend(papers.values())
+        self._layout()
+    
+    
+    def remove_paper(self, paper):
+        if self.hovering is paper:
+            self.hovering = None
+        self.library.remove(paper)
+        self.saved_papers.pop(paper.title, None)
+        self.listed.remove(paper)
+        self.root.elements[Papers].author_index.remove(paper.id)
+        self.root.elements[Filters].library_changed()
+        self._layout()
+    
+    
+    def _layout(self):
+        height = library_row_height*len(self.listed)
+        self.configure(scrollregion=(0, 0, self.winfo_width(), max(height, self.winfo_height())))
+        self._render_rows()
+    
+    
+    def _render_rows(self):
+        view_top = self.canvasy(0)
+        view_bottom = self.canvasy(self.winfo_height())
+        x = self.scrollbar.winfo_width()
+        width = self.winfo_width() - x
+        first = max(0, int(view_top//library_row_height))
+        last = min(len(self.listed), int(view_bottom//library_row_height) + 1)
+        used = 0
+        for i in range(first, last):
+            if used == len(self.rows):
+                row = LibraryRow(self)
+                self.rows.append((self.create_window(0, 0, window=row, anchor='nw'), row))
+            window, row = self.rows[used]
+            row.show(self.listed[i], width)
+            self.coords(window, x, i*library_row_height)
+            self.itemconfigure(window, width=width, height=library_row_height-5, state='normal')
+            used += 1
+        for window, row in self.rows[used:]:
+            self.itemconfigure(window, state='hidden')
+            row.clear()
         self.scrollbar.tkraise()
     
     
+    def _on_configure(self, event):
+        self._layout()
+    
+    
+    def _yview(self, *args):
+        self.yview(*args)
+        self._render_rows()
+    
+    
     def _scroll_db_handler(self, event):
-        self.root.scroller = 'db_handler'    
+        self.root.scroller = 'db_handler'
+    
+    
+
+class LibraryRow(tk.Frame):
+    def __init__(self, handler):
+        tk.Frame.__init__(self, handler, bg=papers_bg)
+        self.canvas = handler
+        self.paper = None
+        self.title = tk.Label(self, font=title_font, bg=title_bg, cursor='hand2', justify='left')
+        self.title.grid(row=0, column=0, padx=40, pady=(5, 0), sticky='w')
+        self.remove_button = tk.Button(self, text='Remove', font=authors_font, bg=button_color, command=self._remove)
+        self.remove_button.grid(row=0, column=1, padx=20, pady=(5, 0), sticky='nw')
+        self.authors = tk.Label(self, font=authors_font, bg=papers_bg, justify='left')
+        self.authors.grid(row=1, column=0, padx=100, sticky='w')
+        self.title.bind('<Button-1>', self._open_link)
+        for widget in (self, self.title, self.authors):
+            widget.bind('<Enter>', self._on_hover)
+            widget.bind('<Leave>', self._on_leave)
+    
+    
+    def show(self, paper, width):
+        if paper is not self.paper:
+            self.paper = paper
+            authors = paper.authors
+            if len(authors) > max_authors_length:
+                authors = authors[:max_authors_length] + ' . . .'
+            self.title.config(text=paper.title, wraplength=width-200)
+            self.authors.config(text=authors, wraplength=width-200)
+        self.paint()
+    
+    
+    def clear(self):
+        self.paper = None
+    
+    
+    def paint(self):
+        if self.paper is None:
+            return
+        hovered = self.paper is self.canvas.hovering
+        self.config(bg=hover_color if hovered else papers_bg)
+        self.title.config(bg=hover_color if hovered else title_bg)
+        self.authors.config(bg=hover_color if hovered else papers_bg)
+    
+    
+    def _open_link(self, event):
+        webbrowser.open_new(self.paper.link)
+    
+    
+    def _remove(self):
+        if self.paper is not None:
+            self.canvas.remove_paper(self.paper)
+    
+    
+    def _on_hover(self, event):
+        if self.paper is not None:
+            self.canvas.hovering = self.paper
+            self.paint()
+    
+    
+    def _on_leave(self, event):
+        if self.paper is not None:
+            self.canvas.hovering = None
+            self.paint()
     
 
 
     
 if __name__ == '__main__':
-    app = Main()
+    parser = argparse.ArgumentParser(description='Browse the newest papers from each journal.')
+    parser.add_argument('--trace', metavar='FILE', help='record timing spans and write them to FILE as Chrome trace events')
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    with span('build window'):
+        app = Main()
     app.mainloop()
+    app.elements[Papers].fetcher.shutdown(wait=False, cancel_futures=True)
         
         
@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journals import Paper
+from search import SearchIndex, has_or, narrows
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for paper_id, title, authors in [('1', 'Spin waves in magnets', 'A. Smith'),
+                                     ('2', 'Kagome lattice metals', 'B. Jones'),
+                                     ('3', 'Spin liquids on kagome', 'C. Sato')]:
+        index.add(Paper('arxiv', paper_id, title, authors, '', ''))
+    return index
+
+
+def test_parse_or_groups(index):
+    assert len(index.parse('spin | kagome')) == 2
+    assert len(index.parse('spin OR kagome')) == 2
+    assert len(index.parse('spin|kagome')) == 1
+    assert has_or('spin |') and has_or('| spin') and has_or('spin OR')
+    assert not has_or('spin|k') and not has_or('spin ORe') and not has_or('title:OR')
+
+
+def test_parse_fields(index):
+    assert index.parse('author:smith') == [[(['authors'], ['smith'], False)]]
+    assert index.parse('title:"spin waves"') == [[(['title'], ['spin', 'waves'], True)]]
+    assert index.parse('foo:bar') == [[(list(SearchIndex.field_weights), ['foo', 'bar'], True)]]
+
+
+@pytest.mark.parametrize('last_query, query', [
+    ('spin', 'spin k'),
+    ('spin', 'spin |'),
+    ('spin |', 'spin | k'),
+    ('spin O', 'spin OR k'),
+    ('author', 'author:s'),
+    ('author:', 'author:s'),
+    ('spin "', 'spin "kag'),
+    ('spin', 'spins'),
+])
+def test_narrowing_finds_what_a_full_search_finds(index, last_query, query):
+    last_hits = set(index.search(last_query) or [])
+    within = last_hits if narrows(last_query, query) else None
+    assert index.search(query, within=within) == index.search(query)
+
+
+def test_narrowing_is_used_for_added_words():
+    assert narrows('spin', 'spin waves')
+    assert narrows('spin', 'spins')
+    assert not narrows('spin |', 'spin | k')
+    assert not narrows('spin', 'kagome')
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Timing spans for State of the Field.
+
+Wrap a phase in `with span('parse', source='prb', page=1):` to time it. Nothing
+is recorded unless tracing is turned on, by setting SOTF_TRACE to a file name
+or passing --trace FILE; span() then costs a single check. With tracing on,
+the spans are written to that file on exit as Chrome trace events (open it in
+chrome://tracing or https://ui.perfetto.dev) and a summary table of where the
+time went is printed.
+
+
+@author: jgwillingham
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+enabled = False
+trace_path = None
+_events = []
+_lock = threading.Lock()
+_start = time.perf_counter()
+
+
+
+class Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, error_type, error, traceback):
+        end = time.perf_counter()
+        if error_type is not None:
+            self.args['error'] = error_type.__name__
+        thread = threading.current_thread()
+        with _lock:
+            _events.append((self.name, self.start, end, thread.ident, thread.name, self.args))
+        return False
+
+
+    def set(self, **args):
+        # adds attributes that are only known once the work is under way, e.g. the size of a download
+        self.args.update(args)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+
+    def set(self, **args):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def span(name, **args):
+    if not enabled:
+        return _no_span
+    return Span(name, args)
+
+
+def traced(name):
+    # decorator form of span, for functions that are timed as a whole
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable(path):
+    global enabled, trace_path
+    if not enabled:
+        atexit.register(finish)
+    enabled = True
+    trace_path = path
+
+
+def chrome_trace():
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+    trace = []
+    threads = {}
+    for name, start, end, tid, thread_name, args in events:
+        threads[tid] = thread_name
+        trace.append({'name':name, 'cat':name.split()[0], 'ph':'X', 'pid':pid, 'tid':tid,
+                      'ts':(start - _start)*1e6, 'dur':(end - start)*1e6, 'args':args})
+    for tid, thread_name in threads.items():
+        trace.append({'name':'thread_name', 'ph':'M', 'pid':pid, 'tid':tid, 'args':{'name':thread_name}})
+    return {'traceEvents':trace, 'displayTimeUnit':'ms'}
+
+
+def summary():
+    # one line per span name: how often it ran and how long it took in total, on average and at most
+    totals = {}
+    with _lock:
+        for name, start, end, tid, thread_name, args in _events:
+            count, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (count + 1, total + end - start, max(longest, end - start))
+    lines = [f'{"span":<24}{"count":>8}{"total ms":>12}{"mean ms":>12}{"max ms":>12}']
+    for name, (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f'{name:<24}{count:>8}{total*1e3:>12.1f}{total*1e3/count:>12.2f}{longest*1e3:>12.1f}')
+    return '\n'.join(lines)
+
+
+def finish():
+    if not enabled:
+        return
+    with open(trace_path, 'w') as out:
+        json.dump(chrome_trace(), out)
+    print(summary(), file=sys.stderr)
+    print(f'trace written to {trace_path}', file=sys.stderr)
+
+
+
+if os.environ.get('SOTF_TRACE'):
+    enable(os.environ['SOTF_TRACE'])